@@ -19,6 +19,12 @@ r = redis.Redis(host=os.getenv('REDIS_HOST', 'redis'),
                 db=0,
                 decode_responses=True)
 
+# directory of the .gt networks created by make_graphs
+NETWORK_DIRECTORY = './data/Networks/'
+
+# number of alternative Steiner trees evaluated at once by connect tasks, see tasks.multi_steiner
+STEINER_THREADS = int(os.getenv('STEINER_THREADS', 4))
+
 identifier_map = {
     'ensembl': 'ensg',
     'ncbigene': 'entrez'
@@ -49,7 +55,7 @@ def run_task(token, algorithm, parameters):
 
     params['config']['identifier'] = identifier_map.get(params['config']['identifier'], params['config']['identifier'])
 
-    task_hook = TaskHook(params, './data/Networks/', set_progress, set_result)
+    task_hook = TaskHook(params, NETWORK_DIRECTORY, set_progress, set_result)
 
     task_hook.parameters["config"].get("identifier", "symbol")
 
@@ -64,6 +70,7 @@ def run_task(token, algorithm, parameters):
             task_hook.parameters["num_trees"] = 5
             task_hook.parameters["tolerance"] = 5
             task_hook.parameters["hub_penalty"] = 0.5
+            task_hook.parameters.setdefault("num_threads", STEINER_THREADS)
             multi_steiner(task_hook)
         elif algorithm == 'keypathwayminer':
             from tasks.keypathwayminer_task import kpm_task
@@ -1,7 +1,14 @@
 from collections import defaultdict
 from typing import List, Tuple
+import hashlib
+import itertools
+import json
+import shutil
 import graph_tool.all as gt
+import numpy as np
 from drugstone import models
+from tasks.util.network_index import NetworkIndex, index_file, fingerprint_file, background_cache_directory, \
+    derived_cache_directory
 import multiprocessing
 from django import db
 from pathlib import Path
@@ -13,6 +20,9 @@ django.setup()
 
 KERNEL = int(os.environ.get('GT_THREADS', 6))
 
+# number of edges passed to graph-tool at once when building a network
+EDGE_BLOCK_SIZE = 100000
+
 
 def _internal_expression_scores(drugstone_id: str) -> dict:
     """ Looks up the tissue specific expression scores for a given protein.
@@ -78,27 +88,126 @@ def _internal_ppis(dataset) -> List[models.ProteinProteinInteraction]:
     return node_node_interaction_objects
 
 
-def create_gt(params: List[str]) -> None:
-    """Fetches all required information to build a graph-tools file for given
-    PPI and PDI dataset names (params). Builds the graph-tools file and saves it in 
-    the data/Networks folder.
+def _fingerprint(queryset, *fields) -> dict:
+    """ Computes a content fingerprint of a table, i.e. the number of rows and a
+    hash of the given fields of all rows in sorted order.
 
     Args:
-        params (Tuple[str, str]): Protein-protein-dataset name, Protein-drug-dataset name
+        queryset (QuerySet): The rows to fingerprint
+        *fields (str): Fields that identify the content of a row, sorted in this order
+
+    Returns:
+        dict: {"count": number of rows, "sha1": hash of the sorted rows}
     """
-    ppi_dataset, pdi_dataset, identifier = params
+    digest = hashlib.sha1()
+    count = 0
+    for row in queryset.order_by(*fields).values_list(*fields).iterator(chunk_size=10000):
+        digest.update('\t'.join(map(str, row)).encode())
+        digest.update(b'\n')
+        count += 1
+    return {'count': count, 'sha1': digest.hexdigest()}
+
 
-    licensed = ppi_dataset.licenced or pdi_dataset.licenced
-    # get data from api
-    
-        # save graph
+def _network_filename(ppi_dataset, pdi_dataset, identifier) -> str:
     filename = f"./data/Networks/{identifier}_{ppi_dataset.name}-{pdi_dataset.name}"
-    if licensed:
+    if ppi_dataset.licenced or pdi_dataset.licenced:
         filename += "_licenced"
-    filename += ".gt"
-    
-    print(f'Creating {filename}')
+    return filename + ".gt"
+
+
+def _is_up_to_date(filename: str, fingerprint: dict) -> bool:
+    """ Checks whether a network and its index were built from inputs with the given fingerprint. """
+    if not os.path.exists(filename) or not NetworkIndex.exists(index_file(filename)):
+        return False
+    try:
+        with open(fingerprint_file(filename)) as f:
+            return json.load(f) == fingerprint
+    except (OSError, ValueError):
+        return False
+
+
+# proteins and drugs shared by all networks, loaded once by Command.handle before forking the build processes
+_nodes = {}
+
+# number of rows fetched per database round trip when streaming tables
+CHUNK_SIZE = 50000
+
+
+def _id_pairs(queryset, *fields) -> np.ndarray:
+    """ Streams two integer columns of a table into a numpy array without instantiating model objects.
+
+    Returns:
+        np.ndarray: array of shape (number of rows, 2)
+    """
+    rows = queryset.values_list(*fields).iterator(chunk_size=CHUNK_SIZE)
+    return np.fromiter(itertools.chain.from_iterable(rows), dtype=np.int64).reshape(-1, 2)
+
+
+def _load_nodes() -> None:
+    """ Loads the proteins, their ensembl genes and the drugs which are the same for every network. """
+    ensembl_set = defaultdict(set)
+    for protein_id, name in models.EnsemblGene.objects.values_list('protein_id', 'name').iterator(chunk_size=CHUNK_SIZE):
+        ensembl_set[protein_id].add(name)
+    _nodes['proteins'] = list(models.Protein.objects.values_list('id', 'uniprot_code', 'gene', 'entrez')
+                              .iterator(chunk_size=CHUNK_SIZE))
+    _nodes['ensembl'] = ensembl_set
+    _nodes['drugs'] = list(models.Drug.objects.values_list('id', 'status').iterator(chunk_size=CHUNK_SIZE))
 
+
+def _protein_groups(identifier: str) -> dict:
+    """ Groups the drugstone protein ids by their id in the given identifier space.
+    Proteins sharing an identifier are merged into one vertex.
+
+    Args:
+        identifier (str): Identifier space, one of 'ensg', 'symbol', 'entrez' and 'uniprot'
+
+    Returns:
+        dict: keys are identifiers and values are sets of drugstone protein ids
+    """
+    is_entrez = (identifier == 'entrez' or identifier == 'ncbigene')
+    is_symbol = identifier == 'symbol'
+    is_uniprot = identifier == 'uniprot'
+    is_ensg = (identifier == 'ensg' or identifier == 'ensembl')
+
+    node_id_map = defaultdict(set)
+    for id, uniprot_code, gene, entrez in _nodes['proteins']:
+        if is_entrez:
+            if len(entrez) != 0:
+                node_id_map[entrez].add(id)
+        elif is_symbol:
+            if len(gene) != 0:
+                node_id_map[gene].add(id)
+        elif is_uniprot:
+            node_id_map[uniprot_code].add(id)
+        elif is_ensg:
+            for ensg in _nodes['ensembl'][id]:
+                node_id_map[ensg].add(id)
+    return node_id_map
+
+
+def _lookup(ids: np.ndarray, vertices: np.ndarray) -> np.ndarray:
+    """ Maps database ids to vertices, -1 for ids without vertex. """
+    found = ids < len(vertices)
+    return np.where(found, vertices[np.where(found, ids, 0)], -1)
+
+
+def _unique_rows(pairs: np.ndarray) -> np.ndarray:
+    """ Removes duplicate rows, keeping the first occurrence of every row in its original position. """
+    _, first = np.unique(pairs, axis=0, return_index=True)
+    return pairs[np.sort(first)]
+
+
+def _build_gt(identifier: str, ppis: np.ndarray, pdis: np.ndarray) -> gt.Graph:
+    """ Builds the network of one identifier space from the interactions of a dataset pair.
+
+    Args:
+        identifier (str): Identifier space, one of 'ensg', 'symbol', 'entrez' and 'uniprot'
+        ppis (np.ndarray): (from protein id, to protein id) of all protein-protein interactions
+        pdis (np.ndarray): (drug id, protein id) of all protein-drug interactions
+
+    Returns:
+        gt.Graph: network with proteins labelled by their id in the identifier space
+    """
     g = gt.Graph(directed=False)
 
     e_type = g.new_edge_property("string")
@@ -120,120 +229,93 @@ def create_gt(params: List[str]) -> None:
     g.vertex_properties["drug_id"] = v_drug_id
     g.vertex_properties["internal_id"] = v_internal_id
 
-    # store nodes to connect them when creating edges
-    vertices = {}
-    drug_vertices = {}
-    # add vertices
-
-    # print("adding nodes")
-    print(f'loading nodes for {identifier}')
-    # extend node data by cancer nodes, we create a normal node for each cancer node.
-    # on reading the data, we decide which one to keep based on the user selected cancer types
-
-    is_entrez = (identifier == 'entrez' or identifier == 'ncbigene')
-    is_symbol = identifier == 'symbol'
-    is_uniprot = identifier == 'uniprot'
-    is_ensg = (identifier == 'ensg' or identifier == 'ensembl')
-
-    if is_ensg:
-        ensembl_set = defaultdict(set)
-        for node in models.EnsemblGene.objects.all():
-            ensembl_set[node.protein_id].add(node.name)
-
-    node_id_map = defaultdict(set)
-    drugstone_ids_to_node_ids = defaultdict(set)
-
-    for node in models.Protein.objects.all():
-        if is_entrez:
-            if len(node.entrez) != 0:
-                node_id_map[node.entrez].add(node.id)
-                drugstone_ids_to_node_ids[node.id].add(node.entrez)
-        elif is_symbol:
-            if len(node.gene) != 0:
-                node_id_map[node.gene].add(node.id)
-                drugstone_ids_to_node_ids[node.id].add(node.gene)
-        elif is_uniprot:
-            node_id_map[node.uniprot_code].add(node.id)
-            drugstone_ids_to_node_ids[node.id].add(node.uniprot_code)
-        elif is_ensg:
-            for id in ensembl_set[node.id]:
-                node_id_map[id].add(node.id)
-                drugstone_ids_to_node_ids[node.id].add(id)
+    print(f'adding nodes for {identifier}')
+    groups = _protein_groups(identifier)
+    drugs = _nodes['drugs']
+    g.add_vertex(len(groups) + len(drugs))
 
-    for id, nodes in node_id_map.items():
-        v = g.add_vertex()
+    # database id -> vertex, -1 for ids without vertex
+    protein_vertices = np.full(max((id for id, _, _, _ in _nodes['proteins']), default=0) + 1, -1, dtype=np.int64)
+    for v, (id, nodes) in enumerate(groups.items()):
         v_type[v] = 'protein'
         v_internal_id[v] = id
-        for drugstone_id in nodes:
-            vertices[drugstone_id] = v
-    print("done with nodes")
+        protein_vertices[list(nodes)] = v
 
-    print(f"adding drugs")
-    for node in models.Drug.objects.all():
-        v = g.add_vertex()
+    drug_vertices = np.full(max((id for id, _ in drugs), default=0) + 1, -1, dtype=np.int64)
+    for v, (id, status) in enumerate(drugs, start=len(groups)):
         v_type[v] = 'drug'
-        v_status[v] = node.status
-        v_internal_id[v] = f'dr{node.id}'
+        v_status[v] = status
+        v_internal_id[v] = f'dr{id}'
+        drug_vertices[id] = v
+
+    # add edges, duplicates are detected on the database ids of the interactions
+    ppis = _unique_rows(np.sort(ppis, axis=1))
+    ppi_edges = np.column_stack([_lookup(ppis[:, 0], protein_vertices), _lookup(ppis[:, 1], protein_vertices)])
+    ppi_edges = ppi_edges[(ppi_edges >= 0).all(axis=1)]
 
-        drug_vertices[node.id] = v
+    pdis = _unique_rows(pdis)
+    pdi_edges = np.column_stack([_lookup(pdis[:, 0], drug_vertices), _lookup(pdis[:, 1], protein_vertices)])
+    pdi_edges = pdi_edges[(pdi_edges >= 0).all(axis=1)]
 
-    print("done with drugs")
+    # string properties cannot be set from arrays, the tuples are therefore only built for one block at a time
+    for edges, edge_type in ((ppi_edges, 'protein-protein'), (pdi_edges, 'drug-protein')):
+        for start in range(0, len(edges), EDGE_BLOCK_SIZE):
+            block = edges[start:start + EDGE_BLOCK_SIZE]
+            g.add_edge_list(list(zip(block[:, 0].tolist(), block[:, 1].tolist(), itertools.repeat(edge_type))),
+                            eprops=[e_type])
 
-    # add edges
-    print(f'adding ppi_edges/{ppi_dataset}')
+    # remove unconnected proteins and drugs
+    degrees = g.get_out_degrees(g.get_vertices())
+    candidates = np.concatenate([protein_vertices[protein_vertices >= 0], drug_vertices[drug_vertices >= 0]])
+    delete_vertices = np.unique(candidates[degrees[candidates] == 0])
 
-    uniq_edges = set()
+    g.remove_vertex(delete_vertices[::-1], fast=True)
+    return g
 
-    for edge_raw in _internal_ppis(ppi_dataset):
-        id1 = edge_raw.from_protein_id
-        id2 = edge_raw.to_protein_id
-        if id1 > id2:
-            tmp = id1
-            id1 = id2
-            id2 = tmp
-        hash = f'{id1}_{id2}'
-        if hash not in uniq_edges and id1 in vertices and id2 in vertices:
-            uniq_edges.add(hash)
-            e = g.add_edge(vertices[id1], vertices[id2])
-            e_type[e] = 'protein-protein'
-    print("done with edges")
 
-    uniq_edges = set()
+def create_gt(params: List[str]) -> None:
+    """Fetches the interactions of the given PPI and PDI datasets once and builds the
+    graph-tools file of every requested identifier space from them. The files are
+    saved in the data/Networks folder.
+
+    Args:
+        params (Tuple[str, str, List[Tuple[str, dict]]]): Protein-protein-dataset, Protein-drug-dataset,
+            list of identifiers to build along with the fingerprint of the inputs that is stored next to the network
+    """
+    ppi_dataset, pdi_dataset, variants = params
 
+    print(f'loading ppi_edges/{ppi_dataset}')
+    ppis = _id_pairs(_internal_ppis(ppi_dataset), 'from_protein_id', 'to_protein_id')
     print(f'loading drug_edges/{pdi_dataset}')
-    for edge_raw in _internal_pdis(pdi_dataset):
-        id1 = edge_raw.drug_id
-        id2 = edge_raw.protein_id
-        hash = f'{id1}_{id2}'
-        if hash not in uniq_edges and id1 in drug_vertices and id2 in vertices:
-            uniq_edges.add(hash)
-            e = g.add_edge(drug_vertices[id1], vertices[id2])
-            e_type[e] = 'drug-protein'
-    print("done with drug edges")
-
-    # remove unconnected proteins
-    delete_vertices = set()
-    for vertex in vertices.values():
-        if vertex.out_degree() == 0:
-            delete_vertices.add(vertex)
-
-    # remove unconnected drugs
-    for vertex in drug_vertices.values():
-        if vertex.out_degree() == 0:
-            delete_vertices.add(vertex)
-
-    g.remove_vertex(reversed(sorted(delete_vertices)), fast=True)
+    pdis = _id_pairs(_internal_pdis(pdi_dataset), 'drug_id', 'protein_id')
+
     Path('./data/Networks/').mkdir(parents=True, exist_ok=True)
-    g.save(filename)
-    print(f"Created file {filename}")
-    return
+    for identifier, fingerprint in variants:
+        filename = _network_filename(ppi_dataset, pdi_dataset, identifier)
+        print(f'Creating {filename}')
+        g = _build_gt(identifier, ppis, pdis)
+        # written next to the network and moved into place, so that workers never read a partial file
+        tmp_filename = f'{filename}.{os.getpid()}.tmp'
+        g.save(tmp_filename, fmt='gt')
+        os.replace(tmp_filename, filename)
+        # precomputed lookup arrays for the tasks, see tasks.util.network_index
+        NetworkIndex.from_graph(g).save(index_file(filename))
+        # null distributions of network_proximity computed on the previous version of the network
+        shutil.rmtree(background_cache_directory(filename), ignore_errors=True)
+        # edge weights, bridges and transition matrices of the previous version, see tasks.util.derived_cache
+        shutil.rmtree(derived_cache_directory(filename), ignore_errors=True)
+        # written last, an interrupted build is therefore never mistaken for an up-to-date network
+        with open(fingerprint_file(filename), 'w') as f:
+            json.dump(fingerprint, f)
+        print(f"Created file {filename}")
 
 
 class Command(BaseCommand):
     def add_arguments(self, parser):
-        pass
+        parser.add_argument('-f', '--force', action='store_true', help='Rebuild all networks, even unchanged ones')
 
     def handle(self, *args, **kwargs):
+        force = kwargs.get('force', False)
         ppi_datasets = models.PPIDataset.objects.all()
 
         pdi_datasets = models.PDIDataset.objects.all()
@@ -241,6 +323,16 @@ class Command(BaseCommand):
         licenced_ppi_dataset = {ppi.name: ppi for ppi in ppi_datasets if ppi.licenced}
         licenced_pdi_dataset = {pdi.name: pdi for pdi in pdi_datasets if pdi.licenced}
 
+        # content fingerprints of all inputs, a network is only rebuilt if one of its inputs changed
+        print('fingerprinting datasets')
+        proteins = {
+            'proteins': _fingerprint(models.Protein.objects.all(), 'id', 'uniprot_code', 'gene', 'entrez'),
+            'ensembl': _fingerprint(models.EnsemblGene.objects.all(), 'protein_id', 'name'),
+        }
+        drugs = _fingerprint(models.Drug.objects.all(), 'id', 'status')
+        ppi_fingerprints = {}
+        pdi_fingerprints = {}
+
         uniq_combis = set()
         parameter_combinations = []
         for protein_interaction_dataset in ppi_datasets:
@@ -257,10 +349,32 @@ class Command(BaseCommand):
                 if hash in uniq_combis:
                     continue
                 uniq_combis.add(hash)
+                if ppi_ds.id not in ppi_fingerprints:
+                    ppi_fingerprints[ppi_ds.id] = _fingerprint(_internal_ppis(ppi_ds), 'from_protein_id', 'to_protein_id')
+                if pdi_ds.id not in pdi_fingerprints:
+                    pdi_fingerprints[pdi_ds.id] = _fingerprint(_internal_pdis(pdi_ds), 'drug_id', 'protein_id')
+                variants = []
                 for identifier in ['ensg', 'symbol', 'entrez', 'uniprot']:
-                    parameter_combinations.append([ppi_ds, pdi_ds, identifier])
+                    fingerprint = {
+                        'identifier': identifier,
+                        'ppi': ppi_fingerprints[ppi_ds.id],
+                        'pdi': pdi_fingerprints[pdi_ds.id],
+                        'drugs': drugs,
+                        # only the ensembl networks depend on the ensembl gene table
+                        'proteins': proteins if identifier == 'ensg' else proteins['proteins'],
+                    }
+                    if not force and _is_up_to_date(_network_filename(ppi_ds, pdi_ds, identifier), fingerprint):
+                        print(f'Skipping unchanged {_network_filename(ppi_ds, pdi_ds, identifier)}')
+                        continue
+                    variants.append((identifier, fingerprint))
+                if variants:
+                    parameter_combinations.append([ppi_ds, pdi_ds, variants])
+        # proteins and drugs are loaded once here and inherited by the build processes
+        if parameter_combinations:
+            _load_nodes()
         # close all database connections so subprocesses will create their own connections
         # this prevents the processes from running into problems because of using the same connection
         db.connections.close_all()
+        print(f'Rebuilding {sum(len(variants) for _, _, variants in parameter_combinations)} networks')
         pool = multiprocessing.Pool(KERNEL)
         pool.map(create_gt, parameter_combinations)
@@ -0,0 +1,60 @@
+import gc
+import importlib
+import time
+
+import rq
+
+from drugstone.backend_tasks import NETWORK_DIRECTORY
+
+# modules imported by the algorithms in backend_tasks.run_task
+PRELOADED_MODULES = [
+    'numpy',
+    'graph_tool',
+    'graph_tool.centrality',
+    'graph_tool.stats',
+    'graph_tool.topology',
+    'graph_tool.util',
+    'tasks.betweenness_centrality',
+    'tasks.closeness_centrality',
+    'tasks.degree_centrality',
+    'tasks.multi_steiner',
+    'tasks.network_proximity',
+    'tasks.quick_task',
+    'tasks.trust_rank',
+]
+
+
+class PreloadWorker(rq.Worker):
+    """rq worker that prepares everything the algorithms need before forking work horses.
+
+    The heavy modules are imported and the networks selected by PRELOAD_NETWORKS are loaded into the
+    graph cache of the worker process once, up to GRAPH_CACHE_MB, see tasks.util.graph_cache.preload.
+    Every work horse is forked from this process and therefore starts with the modules and networks
+    in copy-on-write shared memory instead of importing and parsing them again.
+
+    Start with `rq worker --worker-class drugstone.worker.PreloadWorker ...`.
+    """
+
+    def work(self, *args, **kwargs):
+        start = time.time()
+        for module in PRELOADED_MODULES:
+            importlib.import_module(module)
+        from tasks.util.graph_cache import preload
+        networks = preload(NETWORK_DIRECTORY)
+        self.__freeze()
+        self.log.info(f'Preloaded {len(networks)} networks in {time.time() - start:.1f}s')
+        return super().work(*args, **kwargs)
+
+    def execute_job(self, job, queue):
+        # re-read networks that make_graphs rewrote in the meantime before the work horse inherits the cache,
+        # networks evicted or never preloaded are loaded by the work horses on demand
+        from tasks.util.graph_cache import refresh
+        refresh()
+        self.__freeze()
+        super().execute_job(job, queue)
+
+    @staticmethod
+    def __freeze():
+        # move everything loaded so far out of the garbage collector's reach, otherwise collections in
+        # the work horses touch the objects and unshare their memory pages
+        gc.freeze()
@@ -2,9 +2,9 @@ from tasks.util.custom_edges import add_edges
 from tasks.util.read_graph_tool_graph import read_graph_tool_graph
 from tasks.util.scores_to_results import scores_to_results
 from tasks.util.edge_weights import edge_weights
+from tasks.util.seed_distances import seed_pair_betweenness
 from tasks.task_hook import TaskHook
 import graph_tool as gt
-import graph_tool.topology as gtt
 import os.path
 import sys
 
@@ -64,6 +64,9 @@ def betweenness_centrality(task_hook: TaskHook):
       
     Notes
     -----
+    The scores are obtained by dependency accumulation over the shortest path DAGs of the seeds,
+    which avoids enumerating the shortest paths of every seed pair.
+
     This implementation is based on graph-tool, a very efficient Python package for network
     analysis with C++ backend and multi-threading support. Installation instructions for graph-tool
     can be found at https://git.skewed.de/count0/graph-tool/-/wikis/installation-instructions.
@@ -204,16 +207,7 @@ def betweenness_centrality(task_hook: TaskHook):
     # Call graph-tool to compute betweenness centrality.
     task_hook.set_progress(1 / 3.0, "Computing betweenness centralities.")
     scores = g.new_vertex_property("float")
-    all_pairs = [(source, target) for source in seed_ids for target in seed_ids if source < target]
-    for source, target in all_pairs:
-        local_scores = g.new_vertex_property("float")
-        num_paths = 0.0
-        for path in gtt.all_shortest_paths(g, source, target, weights=weights):
-            local_scores.a[path[1:-1]] += 1
-            num_paths += 1
-        if num_paths > 0:
-            local_scores.a /= num_paths
-        scores.a += local_scores.a
+    scores.a = seed_pair_betweenness(g, seed_ids, weights, num_threads)
 
     # Compute and return the results.
     task_hook.set_progress(2 / 3.0, "Formating results.")
@@ -1,11 +1,11 @@
-import numpy as np
 from tasks.util.custom_edges import add_edges
+from tasks.util.graph_cache import load_network
 from tasks.util.read_graph_tool_graph import read_graph_tool_graph
 from tasks.util.scores_to_results import scores_to_results
 from tasks.util.edge_weights import edge_weights
+from tasks.util.seed_distances import sum_of_distances
 from tasks.task_hook import TaskHook
 import graph_tool as gt
-import graph_tool.topology as gtt
 import os.path
 import sys
 
@@ -180,7 +180,11 @@ def closeness_centrality(task_hook: TaskHook):
     if ppi_dataset['licenced'] or pdi_dataset['licenced']:
         filename += "_licenced"
     filename = os.path.join(task_hook.data_directory, filename + ".gt")
-    g, seed_ids, drug_ids = read_graph_tool_graph(filename, seeds, id_space, max_deg, include_indirect_drugs, include_non_approved_drugs, search_target)
+    # stages of a pipeline such as quick_task share the base network, see TaskHook.resources
+    networks = task_hook.resources.setdefault("networks", {})
+    if filename not in networks:
+        networks[filename] = load_network(filename)
+    g, seed_ids, drug_ids = read_graph_tool_graph(filename, seeds, id_space, max_deg, include_indirect_drugs, include_non_approved_drugs, search_target, network=networks[filename])
     
     if custom_edges:
       edges = task_hook.parameters.get("input_network")['edges']
@@ -195,14 +199,15 @@ def closeness_centrality(task_hook: TaskHook):
     
     # Call graph-tool to compute TrustRank.
     task_hook.set_progress(2 / 4.0, "Computing shortest path closeness centralities.")
-    all_dists = []
-    # score_nodes = drug_ids if search_target == 'drug' else seed_ids
-    for node in seed_ids:
-        dists = gtt.shortest_distance(g, node, weights=weights).get_array()
-        dists[dists == np.inf] = 99999999999
-        all_dists.append(dists+1)
+    if hub_penalty <= 0:
+        # All edges have the same weight, a breadth-first search finds the same distances.
+        hop_length = weights.a[0] if g.num_edges() > 0 else 1.0
+        dist_sums = sum_of_distances(g, seed_ids, None, num_threads, scale=hop_length, unreachable=99999999999)
+    else:
+        dist_sums = sum_of_distances(g, seed_ids, weights, num_threads, unreachable=99999999999)
 
-    scores = len(seed_ids) / (sum([dists for dists in all_dists]))
+    # every distance is increased by one
+    scores = len(seed_ids) / (dist_sums + len(seed_ids))
 
     # Compute and return the results.
     task_hook.set_progress(3 / 4.0, "Formatting results.")
@@ -1,13 +1,21 @@
 from tasks.task_hook import TaskHook
 from tasks.util.custom_edges import add_edges
-from tasks.util.steiner_tree import steiner_tree
+from tasks.util.steiner_tree import steiner_tree, mehlhorn_steiner_tree, MetricClosure
 from tasks.util.find_bridges import find_bridges
+from tasks.util.graph_cache import load_network
 from tasks.util.read_graph_tool_graph import read_graph_tool_graph
-from tasks.util.edge_weights import edge_weights
+from tasks.util.edge_weights import edge_weights, weighted_edges
+from tasks.util.seed_distances import adjacency_matrix, remove_edge
 import os.path
 import graph_tool as gt
-import graph_tool.util as gtu
 import sys
+from concurrent.futures import ThreadPoolExecutor
+
+
+def _edges_in_g(tree):
+    r"""Returns the edges of a tree computed by steiner_tree as pairs of vertex indices of the network."""
+    g_index = tree.vertex_properties["g_index"].a
+    return [(source, target) for source, target in g_index[tree.get_edges()].tolist()]
 
 
 def multi_steiner(task_hook: TaskHook):
@@ -85,6 +93,16 @@ def multi_steiner(task_hook: TaskHook):
     # Acceptable values: Floats between 0 and 1.
     hub_penalty = task_hook.parameters.get("hub_penalty", 0.0)
     
+    # Type: str.
+    # Semantics: Heuristic used to compute the Steiner trees. "kmb" expands the minimum spanning tree
+    #            of the metric closure of the seeds (Kou, Markowsky and Berman), "mehlhorn" the minimum
+    #            spanning tree of the Voronoi regions of the seeds, which only needs one multi-source
+    #            search per tree. Both are 2-approximations.
+    # Example: "mehlhorn".
+    # Reasonable default: "kmb".
+    # Acceptable values: "kmb", "mehlhorn".
+    steiner_algorithm = task_hook.parameters.get("steiner_algorithm", "kmb")
+
     # Type: int.
     # Semantics: Number of threads used for running the analysis.
     # Example: 1.
@@ -115,7 +133,11 @@ def multi_steiner(task_hook: TaskHook):
     if ppi_dataset['licenced'] or pdi_dataset['licenced']:
         filename += "_licenced"
     filename = os.path.join(task_hook.data_directory, filename + ".gt")
-    g, seed_ids, _ = read_graph_tool_graph(filename, seeds, id_space, max_deg, target=search_target)
+    # stages of a pipeline such as quick_task share the base network, see TaskHook.resources
+    networks = task_hook.resources.setdefault("networks", {})
+    if filename not in networks:
+        networks[filename] = load_network(filename)
+    g, seed_ids, _ = read_graph_tool_graph(filename, seeds, id_space, max_deg, target=search_target, network=networks[filename])
 
     if custom_edges:
       edges = task_hook.parameters.get("input_network")['edges']
@@ -128,50 +150,78 @@ def multi_steiner(task_hook: TaskHook):
     # Find first steiner trees
     seeds = list(filter(lambda s: s in seed_map, seeds))
     task_hook.set_progress(2 / (float(num_trees + 3)), "Computing Steiner tree 1 of {}.".format(num_trees))
-    first_tree = steiner_tree(g, seeds, seed_map, weights, hub_penalty > 0)
+    if steiner_algorithm == "kmb":
+        # the searches from the seeds are shared by all trees, see MetricClosure.without_edge
+        closure = MetricClosure(g, [seed_map[seed] for seed in seeds], weights)
+        first_tree = steiner_tree(g, seeds, seed_map, weights, hub_penalty > 0, closure)
+    elif steiner_algorithm == "mehlhorn":
+        # built from the NetworkIndex of the base network and shared by all trees
+        adjacency = adjacency_matrix(g, edges=weighted_edges(g, hub_penalty))
+        first_tree = mehlhorn_steiner_tree(g, seeds, seed_map, weights, hub_penalty > 0, adjacency)
+    else:
+        raise ValueError("Invalid Steiner algorithm {}.".format(steiner_algorithm))
     num_found_trees = 1
-    tree_edges = []
-    for tree_edge in first_tree.edges():
-        source_name = first_tree.vertex_properties[node_name_attribute][first_tree.vertex_index[tree_edge.source()]]
-        target_name = first_tree.vertex_properties[node_name_attribute][first_tree.vertex_index[tree_edge.target()]]
-        tree_edges.append((gtu.find_vertex(g, prop=g.vertex_properties[node_name_attribute], match=source_name)[0], gtu.find_vertex(g, prop=g.vertex_properties[node_name_attribute], match=target_name)[0]))
+    tree_edges = _edges_in_g(first_tree)
     cost_first_tree = sum([weights[g.edge(source, target)] for source, target in tree_edges])
-    returned_nodes = set(int(gtu.find_vertex(g, prop=g.vertex_properties[node_name_attribute], match=first_tree.vertex_properties[node_name_attribute][node])[0]) for node in range(first_tree.num_vertices()))
+    returned_nodes = set(first_tree.vertex_properties["g_index"].a.tolist())
     if num_trees > 1:
         is_bridge = find_bridges(g)
-        edge_filter = g.new_edge_property("boolean", True)
-        found_new_tree = True
-        while len(tree_edges) > 0:
-            if found_new_tree:
-                task_hook.set_progress(float(num_found_trees + 2) / (float(num_trees + 3)), "Computing Steiner tree {} of {}.".format(num_found_trees + 1, num_trees))
-            found_new_tree = False
-            tree_edge = tree_edges.pop()
-            g_edge = g.edge(tree_edge[0], tree_edge[1])
-            if not is_bridge[g_edge]:
-                edge_filter[g_edge] = False
-                g.set_edge_filter(edge_filter)
-                next_tree = steiner_tree(g, seeds, seed_map, weights, hub_penalty > 0)
-                next_tree_edges = set()
-                for next_tree_edge in next_tree.edges():
-                    source_name = next_tree.vertex_properties[node_name_attribute][next_tree.vertex_index[next_tree_edge.source()]]
-                    target_name = next_tree.vertex_properties[node_name_attribute][next_tree.vertex_index[next_tree_edge.target()]]
-                    next_tree_edges.add((gtu.find_vertex(g, prop=g.vertex_properties[node_name_attribute], match=source_name)[0],gtu.find_vertex(g, prop=g.vertex_properties[node_name_attribute], match=target_name)[0]))
-                cost_next_tree = sum([weights[g.edge(source, target)] for source, target in next_tree_edges])
-                if cost_next_tree <= cost_first_tree * ((100.0 + tolerance) / 100.0):
-                    found_new_tree = True
-                    num_found_trees += 1
-                    for node in range(next_tree.num_vertices()):
-                        returned_nodes.add(int(gtu.find_vertex(g, prop=g.vertex_properties[node_name_attribute],match=next_tree.vertex_properties[node_name_attribute][node])[0]))
-                    removed_edges = []
-                    for source, target in tree_edges:
-                        if not ((source, target) in set(next_tree_edges)) or ((target, source) in set(next_tree_edges)):
-                            removed_edges.append((source, target))
-                    for edge in removed_edges:
-                        tree_edges.remove(edge)
-                g.clear_filters()
-                edge_filter[g_edge] = True
-            if num_found_trees >= num_trees:
-                break
+
+        def alternative_tree(view, tree_edge):
+            # view is g without tree_edge, only shared read-only state is accessed
+            if steiner_algorithm == "kmb":
+                next_tree = steiner_tree(view, seeds, seed_map, weights, hub_penalty > 0,
+                                         closure.without_edge(view, tree_edge[0], tree_edge[1]))
+            else:
+                # parallel edges have the same weight and remain in the adjacency matrix
+                if view.edge(tree_edge[0], tree_edge[1]) is None:
+                    view_adjacency = remove_edge(adjacency, tree_edge[0], tree_edge[1])
+                else:
+                    view_adjacency = adjacency
+                next_tree = mehlhorn_steiner_tree(view, seeds, seed_map, weights, hub_penalty > 0, view_adjacency)
+            next_tree_edges = set(_edges_in_g(next_tree))
+            cost_next_tree = sum([weights[g.edge(source, target)] for source, target in next_tree_edges])
+            return next_tree, next_tree_edges, cost_next_tree
+
+        # The alternative tree for a removed edge does not depend on the other removals, so the next
+        # num_threads non-bridge edges to be popped are evaluated at once on their own views of g. Edges
+        # dropped after accepting a tree are skipped as before, their speculative results are discarded.
+        alternative_trees = {}
+        with ThreadPoolExecutor(max_workers=max(num_threads, 1)) as pool:
+            found_new_tree = True
+            while len(tree_edges) > 0:
+                if found_new_tree:
+                    task_hook.set_progress(float(num_found_trees + 2) / (float(num_trees + 3)), "Computing Steiner tree {} of {}.".format(num_found_trees + 1, num_trees))
+                found_new_tree = False
+                tree_edge = tree_edges.pop()
+                g_edge = g.edge(tree_edge[0], tree_edge[1])
+                if not is_bridge[g_edge]:
+                    if tree_edge not in alternative_trees:
+                        batch = [tree_edge]
+                        for edge in reversed(tree_edges):
+                            if len(batch) >= num_threads:
+                                break
+                            if not is_bridge[g.edge(edge[0], edge[1])] and edge not in alternative_trees:
+                                batch.append(edge)
+                        views = []
+                        for source, target in batch:
+                            edge_filter = g.new_edge_property("boolean", True)
+                            edge_filter[g.edge(source, target)] = False
+                            views.append(gt.GraphView(g, efilt=edge_filter))
+                        alternative_trees.update(zip(batch, pool.map(alternative_tree, views, batch)))
+                    next_tree, next_tree_edges, cost_next_tree = alternative_trees.pop(tree_edge)
+                    if cost_next_tree <= cost_first_tree * ((100.0 + tolerance) / 100.0):
+                        found_new_tree = True
+                        num_found_trees += 1
+                        returned_nodes.update(next_tree.vertex_properties["g_index"].a.tolist())
+                        removed_edges = []
+                        for source, target in tree_edges:
+                            if not ((source, target) in next_tree_edges) or ((target, source) in next_tree_edges):
+                                removed_edges.append((source, target))
+                        for edge in removed_edges:
+                            tree_edges.remove(edge)
+                if num_found_trees >= num_trees:
+                    break
     task_hook.set_progress((float(num_trees + 2)) / (float(num_trees + 3)), "Formatting results")
     returned_edges = []
     for node in returned_nodes:
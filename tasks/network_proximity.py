@@ -1,7 +1,10 @@
 from tasks.task_hook import TaskHook
 from tasks.util.custom_edges import add_edges
 from tasks.util.read_graph_tool_graph import read_graph_tool_graph
-from tasks.util.edge_weights import edge_weights
+from tasks.util.edge_weights import weighted_edges
+from tasks.util.seed_distances import adjacency_matrix, min_distances, UNREACHABLE_HOPS
+from tasks.util.proximity_background import cached_background_distribution, degree_binned_z_scores
+from tasks.util.graph_cache import base_edges_of, network_index_of
 import os.path
 import graph_tool as gt
 import graph_tool.topology as gtt
@@ -19,9 +22,6 @@ def network_proximity(task_hook: TaskHook):
     #            utility in frontend.
     # Acceptable values: UNIPROT ACs, identifiers of viral proteins.
     seeds = task_hook.parameters["seeds"]
-    nodes_not_in_lcc = {'D3W0D1', 'O15178', 'O60542', 'O60609', 'O60882', 'Q5T4W7', 'Q6UVW9', 'Q6UW32', 'Q6UWQ7',
-                        'Q6UXB1', 'Q7RTX0', 'Q7RTX1', 'Q8TE23', 'Q9GZZ7', 'Q9H2W2', 'Q9H665', 'Q9NZW4'}
-    # seeds = [node for node in set(seeds).difference(nodes_not_in_lcc)]
 
     # Type: bool
     # Semantics: Sepcifies whether should be included in the analysis when ranking drugs.
@@ -44,6 +44,24 @@ def network_proximity(task_hook: TaskHook):
     # Acceptable values: Positive integers.
     num_random_drug_target_sets = task_hook.parameters.get("num_random_drug_target_sets", 32)
 
+    # Type: str.
+    # Semantics: Background model for the Z-scores. "global" compares all drugs to one distribution of
+    #            uniformly drawn seed and drug target sets. "degree-binned" compares every drug to random
+    #            seed and target sets whose nodes have the same degrees as the seeds and its own targets,
+    #            as proposed by Guney et al. (https://doi.org/10.1038/ncomms10331).
+    # Example: "degree-binned".
+    # Reasonable default: "global".
+    # Acceptable values: "global", "degree-binned".
+    background = task_hook.parameters.get("background", "global")
+
+    # Type: int.
+    # Semantics: Seed for drawing the random seed and drug target sets. The background distribution
+    #            does not depend on num_threads, so a fixed seed makes the Z-scores reproducible.
+    # Example: 42.
+    # Reasonable default: None (fresh randomness for every run).
+    # Acceptable values: Non-negative integers or None.
+    random_seed = task_hook.parameters.get("random_seed", None)
+
     # Type: int.
     # Semantics: Number of returned drugs.
     # Example: 20.
@@ -66,7 +84,8 @@ def network_proximity(task_hook: TaskHook):
     hub_penalty = task_hook.parameters.get("hub_penalty", 0.0)
 
     # Type: int.
-    # Semantics: Number of threads used for running the analysis.
+    # Semantics: Number of threads used for running the analysis. Also the number of processes
+    #            computing the background distribution.
     # Example: 1.
     # Reasonable default: 1.
     # Note: We probably do not want to expose this parameter to the user.
@@ -105,69 +124,99 @@ def network_proximity(task_hook: TaskHook):
     
     # Computing edge weights.
     task_hook.set_progress(1.0 / 8, "Computing edge weights.")
-    weights = edge_weights(g, hub_penalty)
+    edges = weighted_edges(g, hub_penalty)
 
     # Delete drug targets not in LCC.
     task_hook.set_progress(2.0 / 8, "Deleting drug targets not in LCC.")
-    drug_targets = {drug_id: g.get_all_neighbors(drug_id) for drug_id in drug_ids}
-    for drug_id in drug_ids:
-        deleted_targets = []
-        targets = drug_targets[drug_id]
-        for i in range(len(targets)):
-            # if g.vertex_properties["name"][targets[i]] in nodes_not_in_lcc:
-            if g.vertex_properties[node_name_attribute][targets[i]] in nodes_not_in_lcc:
-                deleted_targets.append(i)
-        drug_targets[drug_id] = np.delete(targets, deleted_targets)
-
-    # Compute all shortest path distances.
-    task_hook.set_progress(3.0 / 8, "Computing all shortest path distances.")
-    distances = None
+    # the largest connected component and the degree bins are precomputed on the base network by make_graphs
+    index, base_index = network_index_of(g)
+    in_lcc = index.in_lcc[base_index]
+    drug_targets = {}
+    base_edges = base_edges_of(g)
+    if base_edges is not None:
+        # g keeps all edges between its vertices since indirect drugs are included, so the targets of a drug
+        # are its targets in the base network which are vertices of g
+        _, _, new_ids, _ = base_edges
+        for drug_id in drug_ids:
+            targets = new_ids[index.targets_of(base_index[drug_id])]
+            targets = targets[targets >= 0]
+            drug_targets[drug_id] = targets[in_lcc[targets]]
+    else:
+        for drug_id in drug_ids:
+            targets = g.get_all_neighbors(drug_id)
+            drug_targets[drug_id] = targets[in_lcc[targets]]
+
+    # Compute the distances of all nodes to the closest seed.
+    task_hook.set_progress(3.0 / 8, "Computing shortest path distances from seeds.")
+    adjacency = adjacency_matrix(g, edges=edges)
     if hub_penalty == 0:
-        # distances = np.load(os.path.join(task_hook.data_directory, "host-host-distances.npy"))  # need to create this file and also rename it to protein-protein-distances.npy
-        distances = gtt.shortest_distance(g)
+        # graph-tool reports the maximal int32 value as hop distance of unreachable nodes
+        unweighted, unreachable = True, UNREACHABLE_HOPS
     else:
-        distances = gtt.shortest_distance(g, weights=weights)
-
-    # Compute network proximities.
-    task_hook.set_progress(4.0 / 8, "Computing network proximities.")
-    proximities = {drug_id : 0 for drug_id in drug_ids}
-    for drug_id in drug_ids:
-        distance = 0.0
-        for drug_target in drug_targets[drug_id]:
-            distance += min([distances[drug_target][seed_id] for seed_id in seed_ids])
-        if len(drug_targets[drug_id]) == 0:
-            proximities[drug_id] = np.inf
+        unweighted, unreachable = False, np.inf
+
+    if background == "degree-binned":
+        # Compute network proximities and Z-scores w.r.t. degree-matched random seeds and targets of every drug.
+        task_hook.set_progress(4.0 / 8, "Computing network proximities and degree-binned backgrounds.")
+        lcc_seed_ids = [seed_id for seed_id in seed_ids if in_lcc[seed_id]]
+        if not lcc_seed_ids:
+            raise ValueError("None of the seeds is contained in the largest connected component.")
+        drug_target_ptr = np.concatenate([[0], np.cumsum([len(drug_targets[drug_id]) for drug_id in drug_ids])])
+        z_scores = degree_binned_z_scores(
+            adjacency,
+            lcc_seed_ids,
+            drug_target_ptr,
+            np.concatenate([drug_targets[drug_id] for drug_id in drug_ids] + [np.empty(0, dtype=np.int64)]),
+            index.degree_bins[base_index],
+            num_random_seed_sets,
+            num_random_drug_target_sets,
+            unweighted=unweighted,
+            unreachable=unreachable,
+            num_processes=num_threads,
+            random_seed=random_seed
+        )
+        drugs_with_z_scores = list(zip(drug_ids, z_scores.tolist()))
+    elif background == "global":
+        distances = min_distances(adjacency, [seed_ids], unweighted, unreachable)
+
+        # Compute network proximities.
+        task_hook.set_progress(4.0 / 8, "Computing network proximities.")
+        proximities = {drug_id : 0 for drug_id in drug_ids}
+        for drug_id in drug_ids:
+            if len(drug_targets[drug_id]) == 0:
+                proximities[drug_id] = np.inf
+            else:
+                proximities[drug_id] = distances[0][drug_targets[drug_id]].sum() / float(len(drug_targets[drug_id]))
+
+        # Compute background distribution. Drugs without targets in the LCC keep an infinite proximity and
+        # must not shrink the sizes of the random target sets to zero.
+        task_hook.set_progress(5.0 / 8, "Computing background distribution")
+        num_targets = [len(drug_targets[drug_id]) for drug_id in drug_ids if len(drug_targets[drug_id]) > 0]
+        if num_targets:
+            background_distribution = cached_background_distribution(
+                filename,
+                adjacency,
+                np.flatnonzero(in_lcc),
+                len(seed_ids),
+                min(num_targets),
+                max(num_targets),
+                num_random_seed_sets,
+                num_random_drug_target_sets,
+                unweighted=unweighted,
+                unreachable=unreachable,
+                num_processes=num_threads,
+                random_seed=random_seed
+            )
+            background_mean = np.mean(background_distribution)
+            background_std = np.std(background_distribution)
         else:
-            proximities[drug_id] = distance / float(len(drug_targets[drug_id]))
-
-    # Compute background distribution.
-    task_hook.set_progress(5.0 / 8, "Computing background distribution")
-    min_num_targets = min([len(drug_targets[drug_id]) for drug_id in drug_ids])
-    max_num_targets = max([len(drug_targets[drug_id]) for drug_id in drug_ids])
-    node_ids_in_lcc = [node for node in range(g.num_vertices()) if
-                       # not g.vertex_properties["name"][node] in nodes_not_in_lcc]
-                       not g.vertex_properties[node_name_attribute][node] in nodes_not_in_lcc]
-    background_distribution = []
-    num_seeds = len(seed_ids)
-    for i in range(num_random_seed_sets):
-        np.random.shuffle(node_ids_in_lcc)
-        random_seed_ids = node_ids_in_lcc[:num_seeds]
-        for k in range(num_random_drug_target_sets):
-            np.random.shuffle(node_ids_in_lcc)
-            random_drug_targets = node_ids_in_lcc[:np.random.randint(min_num_targets, max_num_targets + 1)]
-            distance = 0.0
-            for drug_target in random_drug_targets:
-                distance += min([distances[drug_target][seed_id] for seed_id in random_seed_ids])
-            background_distribution.append(distance / float(len(random_drug_targets)))
-    background_mean = np.mean(background_distribution)
-    background_std = np.std(background_distribution)
-
-    # Apply Z-score transformation.
-    task_hook.set_progress(6.0 / 8, "Applying Z-score transformation.")
-    drugs_with_z_scores = [(drug_id, (proximities[drug_id] - background_mean) / background_std) for drug_id in drug_ids]
+            background_mean, background_std = 0.0, 1.0
 
-    task_hook.set_progress(7.0 / 8, "Formatting results.")
-    drugs_with_z_scores = [(drug_id, (proximities[drug_id] - background_mean) / background_std) for drug_id in drug_ids]
+        # Apply Z-score transformation.
+        task_hook.set_progress(6.0 / 8, "Applying Z-score transformation.")
+        drugs_with_z_scores = [(drug_id, (proximities[drug_id] - background_mean) / background_std) for drug_id in drug_ids]
+    else:
+        raise ValueError("Invalid background {}.".format(background))
 
     task_hook.set_progress(7.0 / 8, "Formatting results.")
     best_drugs = [item for item in sorted(drugs_with_z_scores, key=lambda item: item[1])[:result_size]]
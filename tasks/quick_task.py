@@ -2,6 +2,9 @@ from tasks.task_hook import TaskHook
 
 
 def quick_task(task_hook: TaskHook):
+    # the closeness stage runs on the network already loaded by the Steiner stage
+    resources = task_hook.resources
+
     def run_closeness(parameters, network, original_seeds=None):
         from .closeness_centrality import closeness_centrality
 
@@ -20,7 +23,8 @@ def quick_task(task_hook: TaskHook):
         closeness_task_hook = TaskHook(parameters,
                                        task_hook.data_directory,
                                        closeness_progress,
-                                       closeness_set_result)
+                                       closeness_set_result,
+                                       resources)
 
         # Run closeness centrality
         closeness_centrality(closeness_task_hook)
@@ -58,7 +62,8 @@ def quick_task(task_hook: TaskHook):
         ms_task_hook = TaskHook(parameters,
                                 task_hook.data_directory,
                                 ms_progress,
-                                ms_set_result)
+                                ms_set_result,
+                                resources)
 
         # Run multi_steiner
         multi_steiner(ms_task_hook)
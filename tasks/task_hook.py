@@ -1,10 +1,11 @@
 class TaskHook:
 
-    def __init__(self, parameters, data_directory, set_progress, set_result):
+    def __init__(self, parameters, data_directory, set_progress, set_result, resources=None):
         self.__parameters = parameters
         self.__data_directory = data_directory
         self.__set_progress = set_progress
         self.__set_result = set_result
+        self.__resources = resources if resources is not None else {}
 
     @property
     def seeds(self):
@@ -24,6 +25,15 @@ class TaskHook:
         """
         return self.__parameters
 
+    @property
+    def resources(self):
+        """
+        Returns objects shared by the stages of a task, e.g. the network loaded by the first stage.
+
+        :return: Dictionary which the stages read from and add to (e.g. {"networks": {file_path: (g, index)}})
+        """
+        return self.__resources
+
     @property
     def data_directory(self):
         """
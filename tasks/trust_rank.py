@@ -1,10 +1,13 @@
 from tasks.util.custom_edges import add_edges
 from tasks.util.read_graph_tool_graph import read_graph_tool_graph
 from tasks.util.scores_to_results import scores_to_results
-from tasks.util.edge_weights import edge_weights
+from tasks.util.edge_weights import weighted_edges
+from tasks.util.trust_rank_engine import transition_matrix, trust_rank_scores, walk_matrix, \
+    approximate_trust_rank_scores
 from tasks.task_hook import TaskHook
+import functools
 import graph_tool as gt
-import graph_tool.centrality as gtc
+import numpy as np
 import os.path
 import sys
 
@@ -50,6 +53,19 @@ def trust_rank(task_hook: TaskHook):
     num_threads : int, optional (default: 1)
       Number of threads. Requires that graph_tool is compiled with OpenMP support.
       Should not be exposed in the frontend.
+
+    tolerance : float, optional (default: 1e-6)
+      The iteration stops once the L1 norm of the change of the scores is below tolerance.
+
+    max_iterations : int, optional (default: None)
+      Maximal number of iterations, unlimited if None.
+
+    approximate : bool, optional (default: False)
+      If True, the scores are approximated by local forward push instead of power iteration.
+
+    push_threshold : float, optional (default: 1e-5)
+      Residual per unit of edge weight below which the forward push stops exploring a node.
+      Only used if approximate is True.
       
     Returns
     -------
@@ -63,6 +79,8 @@ def trust_rank(task_hook: TaskHook):
         "node_types": The type of the nodes (either "virus", "host", or "drug").
         "is_seed": A flag that specifies whether the node is a seed.
         "scores": The un-normalized scores for all non-seed nodes (nan for the virus proteins).
+      "error_bound": Only if approximate is True, an upper bound of the L1 distance between the
+        approximate and the exact scores of all nodes.
       
     Notes
     -----
@@ -84,6 +102,11 @@ def trust_rank(task_hook: TaskHook):
     are substituted by the set of neighbors :math:`N(u)` and the degree :math:`deg(u)`, 
     respectively.
     
+    With approximate set, the forward push of Andersen, Chung and Lang only explores the neighborhood
+    of the seeds, see tasks.util.trust_rank_engine.approximate_trust_rank_scores. Otherwise, the iteration
+    runs as sparse matrix products on a transition matrix that is cached per
+    filtered network and hub penalty, see tasks.util.trust_rank_engine.
+
     This implementation is based on graph-tool, a very efficient Python package for network
     analysis with C++ backend and multi-threading support. Installation instructions for graph-tool
     can be found at https://git.skewed.de/count0/graph-tool/-/wikis/installation-instructions.
@@ -188,6 +211,36 @@ def trust_rank(task_hook: TaskHook):
     # Note: We probably do not want to expose this parameter to the user.
     num_threads = task_hook.parameters.get("num_threads", 1)
 
+    # Type: float.
+    # Semantics: Convergence threshold for the L1 norm of the change of the scores in one iteration.
+    # Example: 1e-6.
+    # Reasonable default: 1e-6.
+    # Acceptable values: Positive floats.
+    tolerance = task_hook.parameters.get("tolerance", 1e-6)
+
+    # Type: int.
+    # Semantics: Maximal number of iterations.
+    # Example: 100.
+    # Reasonable default: None (iterate until convergence).
+    # Acceptable values: Positive integers or None.
+    max_iterations = task_hook.parameters.get("max_iterations", None)
+
+    # Type: bool.
+    # Semantics: Approximate the scores by local forward push. Saves time on large networks
+    #            if only the nodes close to the seeds are of interest.
+    # Example: True.
+    # Reasonable default: False.
+    # Acceptable values: True, False.
+    approximate = task_hook.parameters.get("approximate", False)
+
+    # Type: float.
+    # Semantics: Residual per unit of edge weight below which the forward push stops exploring a node.
+    #            Smaller values explore more nodes and give a smaller error bound.
+    # Example: 1e-5.
+    # Reasonable default: 1e-5.
+    # Acceptable values: Positive floats.
+    push_threshold = task_hook.parameters.get("push_threshold", 1e-5)
+
     ppi_dataset = task_hook.parameters.get("ppi_dataset")
 
     pdi_dataset = task_hook.parameters.get("pdi_dataset")
@@ -215,7 +268,8 @@ def trust_rank(task_hook: TaskHook):
       g = add_edges(g, edges)
       
     task_hook.set_progress(1 / 4.0, "Computing edge weights.")
-    weights = edge_weights(g, hub_penalty, inverse=True)
+    # only computed if the matrices are not cached yet
+    edges = functools.partial(weighted_edges, g, hub_penalty, inverse=True)
     
     # Set number of threads if OpenMP support is enabled.
     if gt.openmp_enabled():
@@ -223,11 +277,20 @@ def trust_rank(task_hook: TaskHook):
     
     # Call graph-tool to compute TrustRank.
     task_hook.set_progress(2 / 4.0, "Computing TrustRank.")
-    trust = g.new_vertex_property("double")
-    trust.a[seed_ids] = 1.0 / len(seed_ids)
-    scores = gtc.pagerank(g, damping=damping_factor, pers=trust, weight=weights)
+    trust = np.zeros(g.num_vertices())
+    trust[seed_ids] = 1.0 / len(seed_ids)
+    cache_key = (g.graph_properties["network_key"], hub_penalty) if "network_key" in g.graph_properties else None
+    if approximate:
+        walk, total_weights = walk_matrix(g, cache_key=cache_key, edges=edges)
+        scores, error_bound, _ = approximate_trust_rank_scores(walk, total_weights, trust, damping_factor,
+                                                               push_threshold)
+    else:
+        transition, dangling = transition_matrix(g, cache_key=cache_key, edges=edges)
+        scores, _ = trust_rank_scores(transition, dangling, trust, damping_factor, tolerance, max_iterations)
     # Compute and return the results.
     task_hook.set_progress(3 / 4.0, "Formating results.")
     # Convert results to useful output and save it
     results = scores_to_results(search_target, result_size, g, seed_ids, drug_ids, scores, ppi_dataset, pdi_dataset, filter_paths)
+    if approximate:
+        results["error_bound"] = float(error_bound)
     task_hook.set_results(results)
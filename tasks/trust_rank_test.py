@@ -1,6 +1,14 @@
 from tasks.trust_rank import trust_rank
 from tasks.task_hook import TaskHook
+from tasks.util.edge_weights import edge_weights
+from tasks.util.read_graph_tool_graph import read_graph_tool_graph
+from tasks.util.trust_rank_engine import transition_matrix, trust_rank_scores, walk_matrix, \
+    approximate_trust_rank_scores
+import graph_tool.centrality as gtc
+import numpy as np
 import argparse
+import sys
+import time
 
 
 def trust_rank_test(algorithm, parameters):
@@ -24,6 +32,39 @@ def trust_rank_test(algorithm, parameters):
     algorithm(task_hook)
 
 
+def benchmark_approximation(network_file, parameters):
+    r"""Compares the forward push approximation and the power iteration engine to gtc.pagerank."""
+    g, seed_ids, _ = read_graph_tool_graph(network_file, parameters["seeds"], parameters["identifier"],
+                                           parameters["max_deg"], parameters["include_indirect_drugs"],
+                                           parameters["include_non_approved_drugs"], "drug-target")
+    weights = edge_weights(g, parameters["hub_penalty"], inverse=True)
+    damping_factor = parameters["damping_factor"]
+    trust = g.new_vertex_property("double")
+    trust.a[seed_ids] = 1.0 / len(seed_ids)
+    print(f'{g.num_vertices()} nodes, {g.num_edges()} edges, {len(seed_ids)} seeds')
+
+    start = time.time()
+    exact = gtc.pagerank(g, damping=damping_factor, pers=trust, weight=weights).a
+    print(f'gtc.pagerank: {time.time() - start:.3f}s')
+
+    start = time.time()
+    transition, dangling = transition_matrix(g, weights)
+    scores, num_iterations = trust_rank_scores(transition, dangling, trust.a, damping_factor)
+    print(f'power iteration: {time.time() - start:.3f}s, {num_iterations} iterations, '
+          f'L1 error {np.abs(scores - exact).sum():.2e}')
+
+    walk, total_weights = walk_matrix(g, weights)
+    top = set(np.argsort(-exact)[:parameters["result_size"]])
+    for push_threshold in parameters["push_thresholds"]:
+        start = time.time()
+        scores, error_bound, num_pushes = approximate_trust_rank_scores(walk, total_weights, trust.a,
+                                                                        damping_factor, push_threshold)
+        overlap = len(top & set(np.argsort(-scores)[:parameters["result_size"]]))
+        print(f'forward push, threshold {push_threshold:.0e}: {time.time() - start:.3f}s, {num_pushes} pushes, '
+              f'{np.count_nonzero(scores)} nodes reached, L1 error {np.abs(scores - exact).sum():.2e} '
+              f'(bound {error_bound:.2e}), top {parameters["result_size"]} overlap {overlap}')
+
+
 class Range(object):
 
     def __init__(self, start, end, left_open=True, right_open=True):
@@ -87,5 +128,20 @@ if __name__ == '__main__':
                         help="The number of threads used to run the analysis.")
     parser.add_argument("--hub-penalty", type=float, default=0.1,
                         help="Hub penalty.")
+    parser.add_argument("--approximate", action="store_true",
+                        help="If True, the scores are approximated by local forward push.")
+    parser.add_argument("--push-threshold", type=float, default=1e-5,
+                        help="Residual threshold of the forward push.")
+    parser.add_argument("--benchmark", type=str, metavar="NETWORK_FILE",
+                        help="Compare the forward push for several thresholds to gtc.pagerank on the given .gt file.")
+    parser.add_argument("--push-thresholds", type=float, nargs="+", default=[1e-3, 1e-4, 1e-5, 1e-6, 1e-7],
+                        help="Residual thresholds compared by --benchmark.")
+    parser.add_argument("--identifier", type=str, default="symbol",
+                        help="Identifier space of the seeds, used by --benchmark.")
+    parser.add_argument("--max-deg", type=int, default=sys.maxsize,
+                        help="Nodes with higher degrees are ignored, used by --benchmark.")
     parameters = vars(parser.parse_args())
-    trust_rank_test(trust_rank, parameters)
+    if parameters["benchmark"]:
+        benchmark_approximation(parameters["benchmark"], parameters)
+    else:
+        trust_rank_test(trust_rank, parameters)
@@ -1,4 +1,13 @@
+import hashlib
+
+from tasks.util.graph_cache import cached_index
+
+
 def make_node_id_map(g):
+    index = cached_index(g.graph_properties["network"]) if "network" in g.graph_properties else None
+    if index is not None and "base_index" in g.vertex_properties:
+        internal_ids = index.internal_ids[g.vertex_properties["base_index"].a]
+        return dict(zip(internal_ids.tolist(), range(g.num_vertices())))
     mapping = {}
     for node in range(g.num_vertices()):
         mapping[g.vertex_properties['internal_id'][node]] = node
@@ -17,4 +26,12 @@ def add_edges(g, edge_list):
             edge_id_list.append((a, b, 'protein-protein'))
     e_type = g.edge_properties["type"]
     g.add_edge_list(edge_id_list, eprops=[e_type])
+    if "base_edges" in g.graph_properties:
+        # the added edges are not part of the base network
+        del g.graph_properties["base_edges"]
+    if "network_key" in g.graph_properties:
+        # the network differs from the filtered base network now
+        sha1 = hashlib.sha1(g.graph_properties["network_key"].encode())
+        sha1.update(repr(edge_id_list).encode())
+        g.graph_properties["network_key"] = sha1.hexdigest()
     return g
\ No newline at end of file
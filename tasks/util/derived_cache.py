@@ -0,0 +1,80 @@
+import hashlib
+import os
+import shutil
+
+import numpy as np
+from tasks.util.graph_cache import network_file_of
+from tasks.util.network_index import derived_cache_directory
+
+# Number of entries kept per network, the least recently used ones are removed first.
+DERIVED_CACHE_ENTRIES = 64
+
+
+def _entry_directory(g, name, parameters):
+    # the network key identifies the filtered network, see read_graph_tool_graph
+    network_file = network_file_of(g)
+    if network_file is None or "network_key" not in g.graph_properties:
+        return None
+    # keys of networks filtered by the seeds are only hit by tasks with the same seeds
+    if "seed_dependent" in g.graph_properties and g.graph_properties["seed_dependent"]:
+        return None
+    sha1 = hashlib.sha1(repr((g.graph_properties["network_key"], parameters)).encode())
+    return os.path.join(derived_cache_directory(network_file), f"{name}-{sha1.hexdigest()}")
+
+
+def load(g, name, parameters, keys):
+    r"""Returns the arrays stored for the filtered network g under name and parameters, or None.
+
+    The arrays are memory-mapped read-only, so that all worker processes share one physical copy.
+    None is also returned if any of the arrays named in keys is missing, e.g. because another
+    process is evicting the entry.
+    """
+    directory = _entry_directory(g, name, parameters)
+    if directory is None or not os.path.isdir(directory):
+        return None
+    try:
+        arrays = {key: np.load(os.path.join(directory, key + ".npy"), mmap_mode="r") for key in keys}
+        os.utime(directory)
+    except (OSError, ValueError):
+        return None
+    return arrays
+
+
+def store(g, name, parameters, arrays):
+    r"""Stores a dictionary of arrays derived from the filtered network g under name and parameters.
+
+    Values derived from networks read by read_graph_tool_graph are written to derived_cache_directory of
+    the network file, which outlives the work horse that computed them. Nothing is stored for other graphs
+    and for networks whose filtering depended on the seeds, see the "seed_dependent" graph property.
+    """
+    directory = _entry_directory(g, name, parameters)
+    if directory is None:
+        return
+    # entries are written to a temporary directory and moved into place, concurrent writers lose the race
+    tmp_directory = f"{directory}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_directory, ignore_errors=True)
+    os.makedirs(tmp_directory)
+    for key, array in arrays.items():
+        np.save(os.path.join(tmp_directory, key + ".npy"), array)
+    try:
+        os.rename(tmp_directory, directory)
+    except OSError:
+        shutil.rmtree(tmp_directory, ignore_errors=True)
+    _evict(os.path.dirname(directory))
+
+
+def _last_used(entry):
+    try:
+        return os.stat(entry).st_mtime_ns
+    except OSError:
+        return 0
+
+
+def _evict(cache_directory):
+    entries = [os.path.join(cache_directory, entry) for entry in os.listdir(cache_directory)
+               if not entry.endswith(".tmp")]
+    if len(entries) <= DERIVED_CACHE_ENTRIES:
+        return
+    entries.sort(key=_last_used)
+    for entry in entries[:len(entries) - DERIVED_CACHE_ENTRIES]:
+        shutil.rmtree(entry, ignore_errors=True)
@@ -1,17 +1,93 @@
+from collections import OrderedDict
+
 import graph_tool.stats as gts
+import numpy as np
+from tasks.util import derived_cache
+from tasks.util.graph_cache import base_edges_of
 
-def edge_weights(g, hub_penalty, inverse=False):
+# Number of weight arrays kept per worker process.
+WEIGHT_CACHE_SIZE = 16
+
+# (network key, hub penalty, inverse) -> edge weights indexed by edge index, least recently used first
+__weights = OrderedDict()
+
+
+def _degrees(g):
+    degrees = np.zeros(g.num_vertices(ignore_filter=True))
+    vertices = g.get_vertices()
+    degrees[vertices] = g.get_out_degrees(vertices)
+    return degrees
+
+
+def _penalized(degrees, avdeg, sources, targets, hub_penalty, inverse):
+    edge_avdeg = (degrees[sources] + degrees[targets]) / 2.0
+    penalized_weights = (1.0 - hub_penalty) * avdeg + hub_penalty * edge_avdeg
+    return 1.0 / penalized_weights if inverse else penalized_weights
+
+
+def _penalized_weights(g, hub_penalty, inverse):
     avdeg = gts.vertex_average(g, "total")[0]
-    weights = g.new_edge_property("double", val=avdeg)
+    edges = g.get_edges([g.edge_index])
+    values = np.full(g.edge_index_range, avdeg)
+    values[edges[:, 2]] = _penalized(_degrees(g), avdeg, edges[:, 0], edges[:, 1], hub_penalty, inverse)
+    return values
+
+
+def edge_weights(g, hub_penalty, inverse=False):
     if hub_penalty <= 0:
-        return weights
+        avdeg = gts.vertex_average(g, "total")[0]
+        return g.new_edge_property("double", val=avdeg)
     if hub_penalty > 1:
         raise ValueError("Invalid hub penalty {}.".format(hub_penalty))
-    for e in g.edges():
-        edge_avdeg = float(e.source().out_degree() + e.target().out_degree()) / 2.0
-        penalized_weight = (1.0 - hub_penalty) * avdeg + hub_penalty * edge_avdeg
-        if inverse:
-            weights[e] = 1.0 / penalized_weight
+
+    # graphs returned by read_graph_tool_graph identify their filtered network, see network_key
+    key = None
+    if "network_key" in g.graph_properties:
+        key = (g.graph_properties["network_key"], hub_penalty, inverse)
+    values = __weights.get(key)
+    if values is None or len(values) != g.edge_index_range:
+        # work horses are discarded after every job, the weights are therefore also kept on disk unless the
+        # filtered network depends on the seeds, see derived_cache
+        stored = derived_cache.load(g, "weights", (hub_penalty, inverse), ["values"]) if key is not None else None
+        if stored is not None and len(stored["values"]) == g.edge_index_range:
+            values = stored["values"]
         else:
-            weights[e] = penalized_weight
-    return weights
\ No newline at end of file
+            values = _penalized_weights(g, hub_penalty, inverse)
+            if key is not None:
+                derived_cache.store(g, "weights", (hub_penalty, inverse), {"values": values})
+        if key is not None:
+            __weights[key] = values
+            while len(__weights) > WEIGHT_CACHE_SIZE:
+                __weights.popitem(last=False)
+    else:
+        __weights.move_to_end(key)
+    return g.new_edge_property("double", vals=values)
+
+
+def weighted_edges(g, hub_penalty, inverse=False):
+    r"""Returns the end points of all edges of g along with the weights edge_weights assigns to them.
+
+    For graphs returned by read_graph_tool_graph, the edges are read from the memory-mapped NetworkIndex
+    of the base network, see graph_cache.base_edges_of, instead of being collected from g.
+
+    Returns
+    -------
+    sources, targets : numpy.ndarray of int
+      The end points of every edge.
+
+    values : numpy.ndarray of float
+      The weight of every edge.
+    """
+    base_edges = base_edges_of(g)
+    if base_edges is None:
+        edges = g.get_edges([g.edge_index])
+        return edges[:, 0], edges[:, 1], edge_weights(g, hub_penalty, inverse).a[edges[:, 2]]
+
+    index, _, new_ids, rows = base_edges
+    sources, targets = new_ids[index.edges[rows, 0]], new_ids[index.edges[rows, 1]]
+    avdeg = gts.vertex_average(g, "total")[0]
+    if hub_penalty <= 0:
+        return sources, targets, np.full(len(rows), avdeg)
+    if hub_penalty > 1:
+        raise ValueError("Invalid hub penalty {}.".format(hub_penalty))
+    return sources, targets, _penalized(_degrees(g), avdeg, sources, targets, hub_penalty, inverse)
@@ -1,36 +1,48 @@
-import sys
+from collections import OrderedDict
 
-__time = 0
+import graph_tool.topology as gtt
+import numpy as np
+from tasks.util import derived_cache
 
+# Number of bridge masks kept per worker process.
+BRIDGE_CACHE_SIZE = 16
 
-def __dfs_find_bridges(g, node, visited, disc, low, parent, is_bridge):
-    visited[node] = True
-    global __time
-    disc[node] = __time
-    low[node] = __time
-    __time += 1
+# network key -> bridge mask indexed by edge index, least recently used first
+__bridges = OrderedDict()
 
-    for nb in g.get_all_neighbors(node):
-        if not visited[nb]:
-            parent[nb] = node
-            __dfs_find_bridges(g, int(nb), visited, disc, low, parent, is_bridge)
-            low[node] = min(low[node], low[nb])
-            if low[nb] > disc[node]:
-                is_bridge[g.edge(node, nb)] = True
-        elif int(nb) != parent[node]: #TODO can in theory be removed
-            low[node] = min(low[node], disc[nb])
 
-def find_bridges(g):
-    r"""Finds all bridges in a graph."""
-    global __time
-    __time = 0
-    sys.setrecursionlimit(g.num_vertices() + 1)
-    visited = g.new_vertex_property("boolean", False)
-    disc = g.new_vertex_property("float", float("inf"))
-    low = g.new_vertex_property("float", float("inf"))
-    parent = g.new_vertex_property("int", -1)
-    is_bridge = g.new_edge_property("boolean", False)
-    for node in range(g.num_vertices()):
-        if not visited[node]:
-            __dfs_find_bridges(g, node, visited, disc, low, parent, is_bridge)
+def _bridge_mask(g):
+    # a bridge is the only edge of its biconnected component, self-loops are never bridges
+    component, _, _ = gtt.label_biconnected_components(g)
+    edges = g.get_edges([g.edge_index])
+    labels = component.a[edges[:, 2]]
+    is_bridge = np.zeros(g.edge_index_range, dtype=bool)
+    is_bridge[edges[:, 2]] = (np.bincount(labels)[labels] == 1) & (edges[:, 0] != edges[:, 1])
     return is_bridge
+
+
+def find_bridges(g):
+    r"""Finds all bridges in a graph.
+
+    Bridges do not depend on the seeds, so the result is cached per process and on disk, see derived_cache,
+    for graphs returned by read_graph_tool_graph, which identify their filtered network by the "network_key"
+    graph property.
+    """
+    key = g.graph_properties["network_key"] if "network_key" in g.graph_properties else None
+    values = __bridges.get(key)
+    if values is None or len(values) != g.edge_index_range:
+        # work horses are discarded after every job, the mask is therefore also kept on disk
+        stored = derived_cache.load(g, "bridges", (), ["is_bridge"]) if key is not None else None
+        if stored is not None and len(stored["is_bridge"]) == g.edge_index_range:
+            values = stored["is_bridge"]
+        else:
+            values = _bridge_mask(g)
+            if key is not None:
+                derived_cache.store(g, "bridges", (), {"is_bridge": values})
+        if key is not None:
+            __bridges[key] = values
+            while len(__bridges) > BRIDGE_CACHE_SIZE:
+                __bridges.popitem(last=False)
+    else:
+        __bridges.move_to_end(key)
+    return g.new_edge_property("boolean", vals=values)
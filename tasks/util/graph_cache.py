@@ -0,0 +1,208 @@
+import os
+from collections import OrderedDict
+from glob import glob
+
+import graph_tool as gt
+import numpy as np
+from tasks.util.network_index import NetworkIndex, index_file
+
+# Memory budget for all cached base networks of one worker process, in MB. Every rq worker holds its own
+# cache, so the total is this budget times the number of workers (20 in supervisord.conf).
+GRAPH_CACHE_MB = int(os.environ.get('GRAPH_CACHE_MB', 256))
+
+# Comma-separated names of the networks loaded by preload, e.g. 'symbol_nedrex-nedrex'. All if empty.
+PRELOAD_NETWORKS = [name for name in os.environ.get('PRELOAD_NETWORKS', '').split(',') if name]
+
+# network name -> {"path", "stamp", "size", "graph", "index"}, least recently used first
+__cache = OrderedDict()
+
+
+def network_name(file_path):
+    r"""Returns the cache key of a network file, i.e. '{id_space}_{ppi}-{pdi}[_licenced]'."""
+    return os.path.splitext(os.path.basename(file_path))[0]
+
+
+def _stamp(stat):
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _file_stamp(file_path):
+    return _stamp(os.stat(file_path))
+
+
+def _estimated_size(g):
+    # adjacency lists store every undirected edge twice, string properties dominate per vertex
+    return 64 * g.num_edges() + 256 * g.num_vertices()
+
+
+def _load_index(file_path, g):
+    # use the sidecar written by make_graphs unless it is older than the network or does not match it
+    sidecar = index_file(file_path)
+    if NetworkIndex.exists(sidecar) and os.stat(sidecar).st_mtime_ns >= os.stat(file_path).st_mtime_ns:
+        index = NetworkIndex.load(sidecar)
+        if index.num_vertices == g.num_vertices() and len(index.edges) == g.num_edges():
+            return index
+    return NetworkIndex.from_graph(g)
+
+
+def _used():
+    return sum(entry["size"] for entry in __cache.values())
+
+
+def _evict():
+    budget = GRAPH_CACHE_MB * 1024 * 1024
+    used = _used()
+    # always keep the most recently used network, even if it exceeds the budget on its own
+    while used > budget and len(__cache) > 1:
+        _, entry = __cache.popitem(last=False)
+        used -= entry["size"]
+
+
+def load_network(file_path):
+    r"""Returns the parsed base network stored at file_path along with its NetworkIndex.
+
+    The index is memory-mapped from the sidecar written by make_graphs and only rebuilt from the
+    graph if the sidecar is missing or outdated.
+
+    Parsed networks are kept in a process-wide LRU cache keyed by network name and bounded by
+    GRAPH_CACHE_MB. An entry is re-read from disk whenever the modification time or size of the
+    file changed, e.g. after make_graphs rewrote it.
+
+    The returned graph and index are shared between tasks and must not be modified. Use
+    gt.Graph(g) or a gt.GraphView to obtain a graph that can be filtered or extended.
+    """
+    key = network_name(file_path)
+    file_path = os.path.abspath(file_path)
+    entry = __cache.get(key)
+    if entry is not None and entry["path"] == file_path and entry["stamp"] == _file_stamp(file_path):
+        __cache.move_to_end(key)
+        return entry["graph"], entry["index"]
+
+    entry = _read(file_path)
+    __cache[key] = entry
+    __cache.move_to_end(key)
+    _evict()
+    return entry["graph"], entry["index"]
+
+
+def _read(file_path):
+    # the stamp is taken from the opened file, make_graphs replaces networks instead of rewriting them
+    with open(file_path, "rb") as f:
+        stamp = _stamp(os.fstat(f.fileno()))
+        g = gt.load_graph(f, fmt=os.path.splitext(file_path)[1][1:])
+    # the version of the file that was loaded, see read_graph_tool_graph.network_key
+    g.graph_properties["file_stamp"] = g.new_graph_property("string", "{}:{}".format(*stamp))
+    return {"path": file_path, "stamp": stamp, "size": _estimated_size(g), "graph": g, "index": _load_index(file_path, g)}
+
+
+def _try_read(file_path):
+    # the worker process must survive networks that are removed or rewritten while it reads them,
+    # the work horses load such networks on demand instead
+    try:
+        return _read(file_path)
+    except Exception:
+        return None
+
+
+def preload(directory):
+    r"""Loads the networks stored in directory into the cache until GRAPH_CACHE_MB is used up.
+
+    Only the networks named in PRELOAD_NETWORKS are loaded if it is set. Networks that are cached already
+    are left alone, see refresh, and none are evicted: loading stops at the first network that does not
+    fit into the budget. Networks that cannot be read are skipped. Returns the names of all cached networks.
+    """
+    budget = GRAPH_CACHE_MB * 1024 * 1024
+    for file_path in sorted(glob(os.path.join(directory, "*.gt"))):
+        name = network_name(file_path)
+        if name in __cache or (PRELOAD_NETWORKS and name not in PRELOAD_NETWORKS):
+            continue
+        entry = _try_read(os.path.abspath(file_path))
+        if entry is None:
+            continue
+        if _used() + entry["size"] > budget:
+            break
+        __cache[name] = entry
+    return list(__cache)
+
+
+def refresh():
+    r"""Re-reads the cached networks whose files changed and drops those whose files were removed.
+
+    Unchanged networks are not touched, so that their position in the LRU order is kept. Networks that
+    cannot be read are dropped as well. Returns the names of all cached networks.
+    """
+    for name, entry in list(__cache.items()):
+        try:
+            unchanged = _file_stamp(entry["path"]) == entry["stamp"]
+        except OSError:
+            unchanged = False
+        if unchanged:
+            continue
+        updated = _try_read(entry["path"])
+        if updated is None:
+            del __cache[name]
+        else:
+            __cache[name] = updated
+    _evict()
+    return list(__cache)
+
+
+def cached_index(name):
+    r"""Returns the NetworkIndex of a cached network or None if the network is not cached."""
+    entry = __cache.get(name)
+    return entry["index"] if entry is not None else None
+
+
+def network_file_of(g):
+    r"""Returns the path of the base network of a graph returned by read_graph_tool_graph, None if it is not cached."""
+    entry = __cache.get(g.graph_properties["network"]) if "network" in g.graph_properties else None
+    return entry["path"] if entry is not None else None
+
+
+def network_index_of(g):
+    r"""Returns the NetworkIndex of the base network of g and the base network index of every vertex of g.
+
+    Works for graphs returned by read_graph_tool_graph whose base network is cached. For any other graph,
+    an index of g itself is built.
+    """
+    index = cached_index(g.graph_properties["network"]) if "network" in g.graph_properties else None
+    if index is not None and "base_index" in g.vertex_properties:
+        return index, g.vertex_properties["base_index"].a
+    return NetworkIndex.from_graph(g), np.arange(g.num_vertices())
+
+
+def base_edges_of(g):
+    r"""Returns the rows of the NetworkIndex of the base network of g holding the edges of g.
+
+    Works for graphs returned by read_graph_tool_graph whose base network is cached and which were
+    neither extended nor filtered afterwards, None is returned for all other graphs.
+
+    Returns
+    -------
+    index : NetworkIndex
+      The index of the base network.
+
+    base_index : numpy.ndarray of int
+      The base network index of every vertex of g.
+
+    new_ids : numpy.ndarray of int
+      The index in g of every vertex of the base network, -1 for vertices not in g.
+
+    rows : numpy.ndarray of int
+      The rows of index.edges which are edges of g.
+    """
+    if "base_edges" not in g.graph_properties or g.get_vertex_filter()[0] is not None \
+            or g.get_edge_filter()[0] is not None:
+        return None
+    index = cached_index(g.graph_properties["network"]) if "network" in g.graph_properties else None
+    if index is None or "base_index" not in g.vertex_properties:
+        return None
+    base_index = g.vertex_properties["base_index"].a
+    new_ids = np.full(index.num_vertices, -1, dtype=np.int64)
+    new_ids[base_index] = np.arange(len(base_index))
+    return index, base_index, new_ids, g.graph_properties["base_edges"]
+
+
+def clear():
+    r"""Drops all cached networks."""
+    __cache.clear()
@@ -0,0 +1,207 @@
+import os
+import shutil
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+
+# codes of the "type" edge property stored in NetworkIndex.edge_types
+EDGE_TYPES = ("protein-protein", "drug-protein")
+
+# Minimal number of proteins per degree bin, as in the proximity method of Guney et al.
+MIN_BIN_SIZE = 100
+
+
+def index_file(network_file):
+    r"""Returns the path of the sidecar index directory written next to a .gt network file."""
+    return os.path.splitext(network_file)[0] + ".csr"
+
+
+def fingerprint_file(network_file):
+    r"""Returns the path of the JSON file with the input fingerprints of a .gt network file."""
+    return os.path.splitext(network_file)[0] + ".json"
+
+
+def background_cache_directory(network_file):
+    r"""Returns the directory holding the cached proximity background distributions of a .gt network file."""
+    return os.path.splitext(network_file)[0] + ".backgrounds"
+
+
+def derived_cache_directory(network_file):
+    r"""Returns the directory holding the cached edge weights, bridges and transition matrices of a .gt network file."""
+    return os.path.splitext(network_file)[0] + ".derived"
+
+
+def _degree_bins(degree, members, min_bin_size):
+    # groups members with consecutive degrees until every group has at least min_bin_size members
+    bins = np.full(len(degree), -1, dtype=np.int64)
+    degrees, counts = np.unique(degree[members], return_counts=True)
+    bin_of_degree = np.empty(len(degrees), dtype=np.int64)
+    current, size = 0, 0
+    for i, count in enumerate(counts):
+        bin_of_degree[i] = current
+        size += count
+        if size >= min_bin_size:
+            current, size = current + 1, 0
+    # the highest degrees do not fill a bin on their own and are added to the previous one
+    if size > 0 and current > 0:
+        bin_of_degree[bin_of_degree == current] = current - 1
+    bins[members] = bin_of_degree[np.searchsorted(degrees, degree[members])]
+    return bins
+
+
+def _csr(rows, columns, num_rows):
+    order = np.argsort(rows, kind="stable")
+    ptr = np.zeros(num_rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=num_rows), out=ptr[1:])
+    return ptr, columns[order]
+
+
+class NetworkIndex:
+    r"""Seed-independent vertex and edge arrays of a base network.
+
+    The arrays are indexed by the vertex indices of the base network and are used to
+    filter networks with numpy instead of iterating over vertices and edges in Python.
+    All arrays have fixed-width dtypes and are stored as one .npy file each, so that
+    worker processes memory-map them and share one physical copy per network. The scipy
+    matrices of the proximity, Mehlhorn and TrustRank computations are built from these
+    arrays, see edge_weights.weighted_edges, while path searches still run on the parsed
+    graph-tool network of each process.
+
+    Attributes
+    ----------
+    internal_ids : numpy.ndarray of str
+      The "internal_id" vertex property.
+
+    is_drug : numpy.ndarray of bool
+      True for vertices of type "drug".
+
+    is_approved : numpy.ndarray of bool
+      True for drugs whose status contains "approved".
+
+    degree : numpy.ndarray of int
+      The out-degree of every vertex.
+
+    edges : numpy.ndarray of int, shape (num_edges, 3)
+      Source, target and edge index of every edge.
+
+    edge_types : numpy.ndarray of int8
+      Position of the type of every edge in EDGE_TYPES.
+
+    drug_target_ptr, drug_targets : numpy.ndarray of int
+      Targets of every drug in CSR layout, the targets of vertex v are
+      drug_targets[drug_target_ptr[v]:drug_target_ptr[v + 1]].
+
+    in_lcc : numpy.ndarray of bool
+      True for the proteins in the largest connected component of the protein-protein network.
+
+    degree_bins : numpy.ndarray of int
+      Bin of the protein-protein degree of every protein in the largest connected component, -1 for all
+      other vertices. Every bin holds at least MIN_BIN_SIZE proteins with consecutive degrees.
+    """
+
+    ARRAYS = ("internal_ids", "is_drug", "is_approved", "degree", "edges", "edge_types", "drug_target_ptr",
+              "drug_targets", "in_lcc", "degree_bins")
+
+    def __init__(self, internal_ids, is_drug, is_approved, degree, edges, **derived):
+        self.internal_ids = internal_ids
+        self.is_drug = is_drug
+        self.is_approved = is_approved
+        self.degree = degree
+        self.edges = edges
+        if not derived:
+            derived = self.__derived_arrays()
+        self.edge_types = derived["edge_types"]
+        self.drug_target_ptr = derived["drug_target_ptr"]
+        self.drug_targets = derived["drug_targets"]
+        self.in_lcc = derived["in_lcc"]
+        self.degree_bins = derived["degree_bins"]
+        self.__id_to_vertex = None
+
+    @property
+    def num_vertices(self):
+        return len(self.internal_ids)
+
+    @property
+    def id_to_vertex(self):
+        r"""Dictionary mapping internal IDs to vertex indices, built on first access."""
+        if self.__id_to_vertex is None:
+            self.__id_to_vertex = dict(zip(self.internal_ids.tolist(), range(self.num_vertices)))
+        return self.__id_to_vertex
+
+    def vertices_of(self, internal_ids):
+        r"""Returns the vertex indices of all given internal IDs contained in the network."""
+        mapping = self.id_to_vertex
+        return np.array(sorted({mapping[node] for node in internal_ids if node in mapping}), dtype=np.int64)
+
+    def targets_of(self, drug):
+        r"""Returns the vertex indices of all targets of a drug."""
+        return self.drug_targets[self.drug_target_ptr[drug]:self.drug_target_ptr[drug + 1]]
+
+    def __derived_arrays(self):
+        sources, targets = self.edges[:, 0], self.edges[:, 1]
+        target_is_drug = self.is_drug[targets]
+        drug_edges = target_is_drug | self.is_drug[sources]
+        drugs = np.where(target_is_drug, targets, sources)[drug_edges]
+        proteins = np.where(target_is_drug, sources, targets)[drug_edges]
+        drug_target_ptr, drug_targets = _csr(drugs, proteins, self.num_vertices)
+
+        ppi_sources, ppi_targets = sources[~drug_edges], targets[~drug_edges]
+        ppi_degree = np.bincount(np.concatenate([ppi_sources, ppi_targets]), minlength=self.num_vertices)
+        is_protein = ~self.is_drug
+        in_lcc = np.zeros(self.num_vertices, dtype=bool)
+        if is_protein.any():
+            ppis = csr_matrix((np.ones(len(ppi_sources)), (ppi_sources, ppi_targets)),
+                              shape=(self.num_vertices, self.num_vertices))
+            _, labels = connected_components(ppis, directed=False)
+            in_lcc = is_protein & (labels == np.argmax(np.bincount(labels[is_protein])))
+        return {
+            "edge_types": drug_edges.astype(np.int8),
+            "drug_target_ptr": drug_target_ptr,
+            "drug_targets": drug_targets,
+            "in_lcc": in_lcc,
+            "degree_bins": _degree_bins(ppi_degree, np.flatnonzero(in_lcc), MIN_BIN_SIZE),
+        }
+
+    def save(self, directory):
+        r"""Writes every array to directory/<name>.npy, replacing an existing index atomically."""
+        tmp_directory = directory + ".tmp"
+        old_directory = directory + ".old"
+        shutil.rmtree(tmp_directory, ignore_errors=True)
+        os.makedirs(tmp_directory)
+        for name in NetworkIndex.ARRAYS:
+            np.save(os.path.join(tmp_directory, name + ".npy"), getattr(self, name))
+        # processes that still map the old files keep reading them until they reload the network
+        shutil.rmtree(old_directory, ignore_errors=True)
+        if os.path.exists(directory):
+            os.rename(directory, old_directory)
+        os.rename(tmp_directory, directory)
+        shutil.rmtree(old_directory, ignore_errors=True)
+
+    @staticmethod
+    def exists(directory):
+        r"""Returns True if directory holds a complete index written by NetworkIndex.save."""
+        return all(os.path.exists(os.path.join(directory, name + ".npy")) for name in NetworkIndex.ARRAYS)
+
+    @staticmethod
+    def load(directory):
+        r"""Memory-maps an index written by NetworkIndex.save."""
+        arrays = {name: np.load(os.path.join(directory, name + ".npy"), mmap_mode="r") for name in NetworkIndex.ARRAYS}
+        return NetworkIndex(**arrays)
+
+    @staticmethod
+    def from_graph(g):
+        r"""Builds the index of a network created by make_graphs."""
+        internal_id = g.vertex_properties["internal_id"]
+        v_type = g.vertex_properties["type"]
+        status = g.vertex_properties["status"]
+        vertices = range(g.num_vertices())
+        is_drug = np.array([v_type[node] == "drug" for node in vertices], dtype=bool)
+        is_approved = np.array([is_drug[node] and "approved" in status[node] for node in vertices], dtype=bool)
+        return NetworkIndex(
+            internal_ids=np.array([internal_id[node] for node in vertices], dtype=str),
+            is_drug=is_drug,
+            is_approved=is_approved,
+            degree=g.get_out_degrees(g.get_vertices()).astype(np.int64),
+            edges=g.get_edges([g.edge_index]).astype(np.int64).reshape(-1, 3),
+        )
@@ -0,0 +1,272 @@
+import hashlib
+import multiprocessing
+import os
+
+import numpy as np
+from tasks.util.network_index import background_cache_directory, fingerprint_file
+from tasks.util.seed_distances import min_distances
+
+# Number of random seed sets sampled from one random number stream. The chunks and their streams do not
+# depend on the number of processes, so a fixed random_seed yields the same distribution for any pool size.
+CHUNK_SIZE = 8
+
+# Rows with repeated entries are redrawn this many times before they are sampled one by one.
+MAX_REDRAWS = 8
+
+# inputs shared by all chunks of the running computation, inherited by the forked pool processes
+__inputs = None
+
+
+def _sample_without_replacement(rng, population_size, num_rows, num_columns):
+    r"""Draws num_rows independent samples of num_columns distinct positions in range(population_size)."""
+    samples = rng.integers(population_size, size=(num_rows, num_columns))
+    for _ in range(MAX_REDRAWS):
+        ordered = np.sort(samples, axis=1)
+        repeated = np.flatnonzero((ordered[:, 1:] == ordered[:, :-1]).any(axis=1))
+        if len(repeated) == 0:
+            return samples
+        samples[repeated] = rng.integers(population_size, size=(len(repeated), num_columns))
+    # samples covering a large part of the population rarely come out distinct by chance
+    for row in repeated:
+        samples[row] = rng.choice(population_size, size=num_columns, replace=False)
+    return samples
+
+
+def _background_chunk(adjacency, candidates, num_seeds, min_num_targets, max_num_targets, num_seed_sets,
+                      num_drug_target_sets, unweighted, unreachable, seed_sequence):
+    rng = np.random.default_rng(seed_sequence)
+    seed_sets = candidates[_sample_without_replacement(rng, len(candidates), num_seed_sets, num_seeds)]
+    distances = min_distances(adjacency, list(seed_sets), unweighted, unreachable)
+    background = np.empty((num_seed_sets, num_drug_target_sets))
+    for i in range(num_seed_sets):
+        sizes = rng.integers(min_num_targets, max_num_targets + 1, size=num_drug_target_sets)
+        targets = candidates[_sample_without_replacement(rng, len(candidates), num_drug_target_sets, max_num_targets)]
+        # every row holds max_num_targets targets of which the first sizes[k] form the k-th target set
+        in_set = np.arange(max_num_targets) < sizes[:, np.newaxis]
+        background[i] = np.where(in_set, distances[i][targets], 0.0).sum(axis=1) / sizes
+    return background.ravel()
+
+
+def _inherited_chunk(function, *parameters):
+    return function(*__inputs, *parameters)
+
+
+def _chunks(num_random_seed_sets, random_seed):
+    r"""Returns the number of seed sets and the random number stream of every chunk."""
+    chunk_sizes = [min(CHUNK_SIZE, num_random_seed_sets - start) for start in range(0, num_random_seed_sets, CHUNK_SIZE)]
+    return list(zip(chunk_sizes, np.random.SeedSequence(random_seed).spawn(len(chunk_sizes))))
+
+
+def _map_chunks(function, inputs, chunks, num_processes):
+    r"""Returns function(*inputs, *chunk) for all chunks, evaluated by a pool of num_processes forked processes."""
+    if num_processes <= 1 or len(chunks) <= 1:
+        return [function(*inputs, *chunk) for chunk in chunks]
+    global __inputs
+    __inputs = inputs
+    try:
+        with multiprocessing.get_context("fork").Pool(min(num_processes, len(chunks))) as pool:
+            return pool.starmap(_inherited_chunk, [(function,) + chunk for chunk in chunks])
+    finally:
+        __inputs = None
+
+
+def background_distribution(adjacency, candidates, num_seeds, min_num_targets, max_num_targets,
+                            num_random_seed_sets, num_random_drug_target_sets, unweighted=False, unreachable=np.inf,
+                            num_processes=1, random_seed=None):
+    r"""Samples the network proximity of random seed sets and random drug target sets.
+
+    For each of num_random_seed_sets random sets of num_seeds candidate nodes, num_random_drug_target_sets
+    random target sets are drawn from the candidates, each with a uniformly chosen size between
+    min_num_targets and max_num_targets. The proximity of a target set is the mean distance of its
+    targets to the closest seed.
+
+    The seed sets are sampled in chunks of CHUNK_SIZE, each with its own random number stream spawned
+    from random_seed. Chunks are evaluated by a pool of num_processes forked processes, which inherit the
+    adjacency matrix and the candidates instead of receiving a copy with every chunk. Seed and target sets
+    are truncated to the number of candidates.
+
+    Parameters
+    ----------
+    adjacency : scipy.sparse.csr_matrix
+      The adjacency matrix returned by seed_distances.adjacency_matrix.
+
+    candidates : numpy.ndarray of int
+      The nodes from which random seeds and targets are drawn.
+
+    unweighted, unreachable :
+      Passed on to seed_distances.min_distances.
+
+    num_processes : int, optional (default: 1)
+      Number of processes evaluating the chunks.
+
+    random_seed : int, optional (default: None)
+      Seed of the random number generator. If None, fresh entropy is used.
+
+    Returns
+    -------
+    background : numpy.ndarray of float, shape (num_random_seed_sets * num_random_drug_target_sets,)
+      The proximities of all random target sets, grouped by random seed set.
+    """
+    if not 0 < min_num_targets <= max_num_targets:
+        raise ValueError("Invalid number of random targets between {} and {}.".format(min_num_targets, max_num_targets))
+    num_seeds = min(num_seeds, len(candidates))
+    min_num_targets = min(min_num_targets, len(candidates))
+    max_num_targets = min(max_num_targets, len(candidates))
+    chunks = [(num_seeds, min_num_targets, max_num_targets, chunk_size, num_random_drug_target_sets, unweighted,
+               unreachable, seed_sequence)
+              for chunk_size, seed_sequence in _chunks(num_random_seed_sets, random_seed)]
+    backgrounds = _map_chunks(_background_chunk, (adjacency, candidates), chunks, num_processes)
+    return np.concatenate(backgrounds) if backgrounds else np.empty(0)
+
+
+def _cache_key(network_file, adjacency, candidates, parameters):
+    sha1 = hashlib.sha1()
+    # ties the entry to one build of the network, make_graphs also drops the whole cache when rebuilding
+    if os.path.exists(fingerprint_file(network_file)):
+        with open(fingerprint_file(network_file), "rb") as f:
+            sha1.update(f.read())
+    else:
+        sha1.update(repr(os.stat(network_file).st_mtime_ns).encode())
+    # the filtered network depends on the task parameters, e.g. max_deg or custom edges
+    for array in (adjacency.indptr, adjacency.indices, adjacency.data, candidates):
+        sha1.update(np.ascontiguousarray(array).tobytes())
+    sha1.update(repr(parameters).encode())
+    return sha1.hexdigest()
+
+
+def cached_background_distribution(network_file, adjacency, candidates, num_seeds, min_num_targets, max_num_targets,
+                                   num_random_seed_sets, num_random_drug_target_sets, unweighted=False,
+                                   unreachable=np.inf, num_processes=1, random_seed=None):
+    r"""Returns background_distribution(...) from the on-disk cache of the network stored at network_file.
+
+    The background does not depend on which nodes are seeds, only on the filtered network, the candidates
+    and the sampling parameters. It is therefore stored in background_cache_directory(network_file) under
+    a hash of these inputs and of the network fingerprint, and only computed on a cache miss.
+    """
+    parameters = (num_seeds, min_num_targets, max_num_targets, num_random_seed_sets, num_random_drug_target_sets,
+                  unweighted, float(unreachable), random_seed)
+    directory = background_cache_directory(network_file)
+    cache_file = os.path.join(directory, _cache_key(network_file, adjacency, candidates, parameters) + ".npy")
+    if os.path.exists(cache_file):
+        try:
+            return np.load(cache_file)
+        except (OSError, ValueError):
+            pass
+
+    background = background_distribution(adjacency, candidates, num_seeds, min_num_targets, max_num_targets,
+                                         num_random_seed_sets, num_random_drug_target_sets, unweighted, unreachable,
+                                         num_processes, random_seed)
+    os.makedirs(directory, exist_ok=True)
+    # concurrent tasks may compute the same entry, the file is replaced atomically
+    tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+    with open(tmp_file, "wb") as f:
+        np.save(f, background)
+    os.replace(tmp_file, cache_file)
+    return background
+
+
+def _degree_matched(rng, bins, originals, num_samples):
+    r"""Replaces every original node by a node drawn uniformly, with replacement, from its degree bin."""
+    degree_bins, members, bin_sizes, bin_ptr = bins
+    original_bins = degree_bins[originals]
+    return members[bin_ptr[original_bins] + rng.integers(bin_sizes[original_bins], size=(num_samples, len(originals)))]
+
+
+def _proximities(target_distances, starts, num_targets, unreachable):
+    r"""Returns the mean distance of every target set and whether all of its targets are reachable."""
+    proximities = np.add.reduceat(target_distances, starts, axis=-1) / num_targets
+    reached = ~np.logical_or.reduceat(target_distances >= unreachable, starts, axis=-1)
+    return proximities, reached
+
+
+def _degree_binned_chunk(adjacency, seed_ids, bins, starts, num_targets, drug_targets, num_drug_target_sets,
+                         unweighted, unreachable, num_seed_sets, seed_sequence):
+    rng = np.random.default_rng(seed_sequence)
+    distances = min_distances(adjacency, list(_degree_matched(rng, bins, seed_ids, num_seed_sets)), unweighted,
+                              unreachable)
+    # number, sum and sum of squares of the proximities of the random target sets of every drug
+    sums = np.zeros((3, len(starts)))
+    for i in range(num_seed_sets):
+        targets = _degree_matched(rng, bins, drug_targets, num_drug_target_sets)
+        proximities, reached = _proximities(distances[i][targets], starts, num_targets, unreachable)
+        proximities = np.where(reached, proximities, 0.0)
+        sums += [reached.sum(axis=0), proximities.sum(axis=0), np.square(proximities).sum(axis=0)]
+    return sums
+
+
+def degree_binned_z_scores(adjacency, seed_ids, drug_target_ptr, drug_targets, degree_bins, num_random_seed_sets,
+                           num_random_drug_target_sets, unweighted=False, unreachable=np.inf, num_processes=1,
+                           random_seed=None):
+    r"""Computes the proximity Z-score of every drug w.r.t. its own degree-matched background [1_].
+
+    The proximity of a drug is the mean distance of its targets to the closest seed. It is compared to the
+    proximities of num_random_seed_sets random seed sets times num_random_drug_target_sets random target
+    sets, where every seed and every target is replaced by a node drawn uniformly, with replacement, from
+    its degree bin. The random target sets of all drugs are drawn and evaluated at once per seed set.
+
+    The degree bins are computed on the base network, so random targets may be unreachable from the random
+    seeds in the filtered network. Such target sets are left out of the background. The random seed sets are
+    sampled and evaluated in chunks like in background_distribution.
+
+    Parameters
+    ----------
+    adjacency : scipy.sparse.csr_matrix
+      The adjacency matrix returned by seed_distances.adjacency_matrix.
+
+    seed_ids : list of int
+      The seeds, all of which must have a degree bin.
+
+    drug_target_ptr, drug_targets : numpy.ndarray of int
+      The targets of all drugs in CSR layout, all of which must have a degree bin.
+
+    degree_bins : numpy.ndarray of int
+      The degree bin of every node or -1 for nodes that must not be drawn.
+
+    unweighted, unreachable :
+      Passed on to seed_distances.min_distances.
+
+    num_processes : int, optional (default: 1)
+      Number of processes evaluating the chunks.
+
+    random_seed : int, optional (default: None)
+      Seed of the random number generator. If None, fresh entropy is used.
+
+    Returns
+    -------
+    z_scores : numpy.ndarray of float
+      The Z-score of every drug, inf for drugs without targets, with targets unreachable from the seeds or
+      without any reachable random target set.
+
+    References
+    ----------
+    .. [1] E. Guney, J. Menche, M. Vidal, A.-L. Barabási, Network-based in silico drug efficacy screening,
+       Nature Communications 7, 2016, 10331, https://doi.org/10.1038/ncomms10331.
+    """
+    num_targets = np.diff(drug_target_ptr)
+    has_targets = num_targets > 0
+    z_scores = np.full(len(num_targets), np.inf)
+    if not has_targets.any():
+        return z_scores
+    nodes = np.flatnonzero(degree_bins >= 0)
+    bin_sizes = np.bincount(degree_bins[nodes])
+    bins = (degree_bins, nodes[np.argsort(degree_bins[nodes], kind="stable")], bin_sizes,
+            np.concatenate([[0], np.cumsum(bin_sizes)[:-1]]))
+    seed_ids = np.asarray(seed_ids)
+    starts = drug_target_ptr[:-1][has_targets]
+    num_targets = num_targets[has_targets]
+
+    inputs = (adjacency, seed_ids, bins, starts, num_targets, drug_targets)
+    chunks = [(num_random_drug_target_sets, unweighted, unreachable, chunk_size, seed_sequence)
+              for chunk_size, seed_sequence in _chunks(num_random_seed_sets, random_seed)]
+    counts, total, total_squares = sum(_map_chunks(_degree_binned_chunk, inputs, chunks, num_processes),
+                                       np.zeros((3, len(starts))))
+
+    distances = min_distances(adjacency, [seed_ids], unweighted, unreachable)
+    proximities, reached = _proximities(distances[0][drug_targets], starts, num_targets, unreachable)
+    scored = reached & (counts > 0)
+    mean = total[scored] / counts[scored]
+    std = np.sqrt(np.maximum(total_squares[scored] / counts[scored] - np.square(mean), 0.0))
+    scores = np.full(len(starts), np.inf)
+    scores[scored] = (proximities[scored] - mean) / std
+    z_scores[has_targets] = scores
+    return z_scores
@@ -1,15 +1,33 @@
+import hashlib
+
 import graph_tool as gt
-import graph_tool.topology as gtt
+import numpy as np
+from tasks.util.graph_cache import load_network, network_name
+from tasks.util.network_index import EDGE_TYPES
+
+
+def network_key(file_path, file_stamp, kept, kept_edges):
+    r"""Returns a hash of the network file version and of the vertex and edge masks applied to it.
+
+    file_stamp identifies the version of the file the base network was loaded from, see the "file_stamp"
+    graph property set by graph_cache.load_network.
+    """
+    sha1 = hashlib.sha1(f"{network_name(file_path)}:{file_stamp}".encode())
+    sha1.update(np.packbits(kept).tobytes())
+    sha1.update(np.packbits(kept_edges).tobytes())
+    return sha1.hexdigest()
 
 
 # def read_graph_tool_graph(file_path, seeds, datasets, ignored_edge_types, max_deg, ignore_non_seed_baits=False, include_indirect_drugs=False, include_non_approved_drugs=False):
 def read_graph_tool_graph(file_path, seeds, id_space, max_deg, include_indirect_drugs=False,
                           include_non_approved_drugs=False,
-                          target='drug'):
+                          target='drug', network=None):
     r"""Reads a graph-tool graph from file.
 
     Reads a graph-tool graph from graphml or gt file and returns is along
-    with the internal IDs of the seed and viral seeds and the drugs.
+    with the internal IDs of the seed and viral seeds and the drugs. The parsed
+    file is cached per worker process, see tasks.util.graph_cache, and filtered
+    with vertex and edge masks computed from its NetworkIndex.
 
     Parameters
     ----------
@@ -28,6 +46,10 @@ def read_graph_tool_graph(file_path, seeds, id_space, max_deg, include_indirect_
     target : str
       A string specifying the target of the search, either "drug" or "drug-target"
 
+    network : tuple, optional
+      The base network stored at file_path and its NetworkIndex as returned by
+      graph_cache.load_network, e.g. from an earlier stage of the same task. Loaded if None.
+
     Returns
     -------
     g : graph_tool.Graph
@@ -39,92 +61,77 @@ def read_graph_tool_graph(file_path, seeds, id_space, max_deg, include_indirect_
     drug_ids : list of int
       The graph indices for all drug nodes
     """
-    # Read the graph.
-    g = gt.load_graph(file_path)
+    base, index = network if network is not None else load_network(file_path)
 
-    # drug_protein = "DrugHasTarget"
     d_type = "drug"
-    node_name_attribute = "internal_id"  # nodes in the input network which is created from RepoTrialDB have primaryDomainId as name attribute
-    # Delete all nodes that are not contained in the selected datasets and have degrees higher than max_deg
-    deleted_nodes = []
-    for node in range(g.num_vertices()):
-        # Remove all unconnected nodes TODO probably already skip when creating .gt files
-        if g.vertex(node).out_degree() == 0 and target == 'drug':
-            deleted_nodes.append(node)
-        elif not g.vertex_properties[node_name_attribute][node] in set(seeds) and (
-                g.vertex(node).out_degree() > max_deg):
-            deleted_nodes.append(node)
-        # remove all drugs from graph if we are not looking for drugs
-        elif target != 'drug' and g.vertex_properties["type"][node] == d_type:
-            deleted_nodes.append(node)
-
-    g.remove_vertex(reversed(sorted(deleted_nodes)), fast=True)
-
-    # Retrieve internal IDs of seed_ids
-    seeds = set(seeds)
-    seed_ids = {}
-    drug_ids = []
-    for node in range(g.num_vertices()):
-        node_type = g.vertex_properties["type"][node]
-        seed_id = g.vertex_properties[node_name_attribute][node]
-        if seed_id in seeds:
-            seed_ids[node] = seed_id
-        if node_type == d_type:
-            if include_non_approved_drugs:
-                drug_ids.append(node)
-            else:
-                # drug_groups = g.vertex_properties["status"][node].split(', ')
-                if "approved" in g.vertex_properties["status"][node]:
-                    drug_ids.append(node)
-
-    # Delete edges that should be ignored or are not contained in the selected dataset.
-    deleted_edges = []
-
-    for edge in g.edges():
-        if edge.source == edge.target:
-            deleted_edges.append(edge)
-
-    g.set_fast_edge_removal(fast=True)
-    for edge in deleted_edges:
-        g.remove_edge(edge)
-    g.set_fast_edge_removal(fast=False)
-
-    deleted_edges = []
-
-    # If only_direct_drugs should be included, remove any drug-protein edges that the drug is not a direct neighbor of
-    # any seeds
-    if drug_ids and not include_indirect_drugs:
-        direct_drugs = set()
-        for edge in g.edges():
-            if g.vertex_properties["type"][edge.target()] == d_type and edge.source() in seed_ids:
-                direct_drugs.add(edge.target())
-            elif g.vertex_properties["type"][edge.source()] == d_type and edge.target() in seed_ids:
-                direct_drugs.add(edge.source())
-        for edge in g.edges():
-            if g.edge_properties["type"][edge] == 'drug-protein':
-                if g.vertex_properties["type"][edge.target()] == d_type:
-                    indir_drug = edge.target() not in direct_drugs
-                    not_seed = edge.source() not in seed_ids
-                    if indir_drug or not_seed:
-                        deleted_edges.append(edge)
-                    if indir_drug and int(edge.target()) in drug_ids:
-                        drug_ids.remove(int(edge.target()))
-
-                elif g.vertex_properties["type"][edge.source()] == d_type and \
-                        edge.source() not in direct_drugs or edge.target() not in seed_ids:
-                    indir_drug = edge.source() not in direct_drugs
-                    not_seed = edge.target() not in seed_ids
-                    if indir_drug or not_seed:
-                        deleted_edges.append(edge)
-                    if indir_drug and int(edge.source()) in drug_ids:
-                        drug_ids.remove(int(edge.source()))
-            # else:
-            #     deleted_edges.append(edge)
-
-    g.set_fast_edge_removal(fast=True)
-    for edge in deleted_edges:
-        g.remove_edge(edge)
-    g.set_fast_edge_removal(fast=False)
+    is_seed = np.zeros(index.num_vertices, dtype=bool)
+    is_seed[index.vertices_of(seeds)] = True
+
+    # Delete all nodes that have degrees higher than max_deg, unconnected nodes if we are looking for
+    # drugs and all drugs if we are not looking for drugs
+    deleted = ~is_seed & (index.degree > max_deg)
+    if target == d_type:
+        deleted |= index.degree == 0
+    else:
+        deleted |= index.is_drug
+    kept = ~deleted
+    # seeds exempted from max_deg make the filtered network depend on the seeds
+    seed_dependent = bool((is_seed & (index.degree > max_deg)).any())
+    is_seed &= kept
+
+    sources, targets, edge_ids = index.edges[:, 0], index.edges[:, 1], index.edges[:, 2]
+    kept_edges = kept[sources] & kept[targets]
+    # Self-loops are kept, the former edge.source == edge.target check never matched.
+
+    is_drug = kept & index.is_drug
+    if not include_non_approved_drugs:
+        is_drug &= index.is_approved
+
+    # If only direct drugs should be included, remove any drug-protein edges that do not connect a seed with
+    # a drug that is a direct neighbor of any seed
+    if is_drug.any() and not include_indirect_drugs:
+        target_is_drug = index.is_drug[targets]
+        drug_edges = kept_edges & (index.edge_types == EDGE_TYPES.index("drug-protein"))
+        drug_ends = np.where(target_is_drug, targets, sources)
+        protein_ends = np.where(target_is_drug, sources, targets)
+        direct_drugs = np.zeros(index.num_vertices, dtype=bool)
+        direct_drugs[drug_ends[drug_edges & is_seed[protein_ends]]] = True
+        indirect_drugs = np.zeros(index.num_vertices, dtype=bool)
+        indirect_drugs[drug_ends[drug_edges & ~direct_drugs[drug_ends]]] = True
+        kept_edges &= ~(drug_edges & ~(direct_drugs[drug_ends] & is_seed[protein_ends]))
+        is_drug &= ~indirect_drugs
+        seed_dependent = True
+
+    # Vertex indices after removal: each deleted vertex is swapped with the last one, as in
+    # g.remove_vertex(..., fast=True) on the deleted vertices in descending order.
+    old_ids = np.arange(index.num_vertices)
+    num_kept = index.num_vertices
+    for node in np.flatnonzero(deleted)[::-1]:
+        num_kept -= 1
+        old_ids[node] = old_ids[num_kept]
+    new_ids = np.full(index.num_vertices, -1, dtype=np.int64)
+    new_ids[old_ids[:num_kept]] = np.arange(num_kept)
+
+    vfilt = base.new_vertex_property("bool")
+    vfilt.a = kept
+    efilt = base.new_edge_property("bool")
+    efilt.a[edge_ids] = kept_edges
+    vorder = base.new_vertex_property("int64_t")
+    vorder.a = new_ids
+    g = gt.Graph(gt.GraphView(base, vfilt=vfilt, efilt=efilt), prune=True, vorder=vorder)
+    # Remember where the vertices came from, so that the cached NetworkIndex can be used for g.
+    g.graph_properties["network"] = g.new_graph_property("string", network_name(file_path))
+    g.vertex_properties["base_index"] = g.new_vertex_property("int64_t", vals=old_ids[:num_kept])
+    # Identifies the filtered network, so that values derived from it can be cached across tasks.
+    key = network_key(file_path, base.graph_properties["file_stamp"], kept, kept_edges)
+    g.graph_properties["network_key"] = g.new_graph_property("string", key)
+    # Networks filtered by the seeds are rarely seen again, their derived values are not stored on disk.
+    g.graph_properties["seed_dependent"] = g.new_graph_property("bool", seed_dependent)
+    # The edges of g as rows of the NetworkIndex, so that edge arrays can be read from the memory-mapped index.
+    g.graph_properties["base_edges"] = g.new_graph_property("object", np.flatnonzero(kept_edges))
+
+    seed_ids = np.sort(new_ids[is_seed]).tolist()
+    drug_ids = np.sort(new_ids[is_drug]).tolist()
 
     # Return the graph and the indices of the seed_ids and the seeds.
-    return g, list(seed_ids.keys()), drug_ids
+    return g, seed_ids, drug_ids
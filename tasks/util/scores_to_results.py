@@ -1,4 +1,42 @@
+import graph_tool as gt
 import graph_tool.topology as gtt
+import numpy as np
+
+# distance graph-tool reports for unreachable vertices in unweighted searches
+UNREACHABLE_HOPS = np.iinfo(np.int32).max
+
+
+def _best_candidates(candidates, values, result_size):
+    r"""Returns the result_size candidates with the highest values, ties are kept in their given order."""
+    if 0 <= result_size < len(candidates):
+        kth_value = values[np.argpartition(values, len(values) - result_size)[len(values) - result_size]] \
+            if result_size > 0 else np.inf
+        keep = values > kth_value
+        ties = np.flatnonzero(values == kth_value)[:result_size - np.count_nonzero(keep)]
+        keep[ties] = True
+        candidates, values = candidates[keep], values[keep]
+    order = np.lexsort((np.arange(len(values)), -values))
+    return candidates[order][:result_size].tolist()
+
+
+def _shortest_path_trees(g, seed_ids):
+    distances, predecessors = [], []
+    for seed_id in seed_ids:
+        dist, pred = gtt.shortest_distance(g, seed_id, pred_map=True)
+        distances.append(dist.get_array().copy())
+        predecessors.append(pred.get_array().copy())
+    return distances, predecessors
+
+
+def _path(distances, predecessors, node):
+    r"""Returns the vertices on the path from node to the root of a shortest path tree, [] if it is unreachable."""
+    if distances[node] == UNREACHABLE_HOPS:
+        return []
+    vertices = [node]
+    while distances[node] > 0:
+        node = int(predecessors[node])
+        vertices.append(node)
+    return vertices
 
 
 def scores_to_results(
@@ -15,12 +53,15 @@ def scores_to_results(
     r"""Transforms the scores to the required result format."""
 
     node_name_attribute = "internal_id"  # nodes in the input network which is created from RepoTrialDB have primaryDomainId as name attribute
+    score_values = np.asarray(scores.get_array() if isinstance(scores, gt.VertexPropertyMap) else scores)
+    is_seed_node = np.zeros(g.num_vertices(), dtype=bool)
+    is_seed_node[seed_ids] = True
     if target == "drug":
-        candidates = [(node, scores[node]) for node in drug_ids if scores[node] > 0]
+        candidates = np.asarray(drug_ids, dtype=np.int64)
     else:
-        candidates = [(node, scores[node]) for node in range(g.num_vertices()) if
-                      scores[node] > 0 and node not in set(seed_ids)]
-    best_candidates = [item[0] for item in sorted(candidates, key=lambda item: item[1], reverse=True)[:result_size]]
+        candidates = np.flatnonzero(~is_seed_node)
+    candidates = candidates[score_values[candidates] > 0]
+    best_candidates = _best_candidates(candidates, score_values[candidates], result_size)
     # Concatenate best result candidates with seeds and compute induced subgraph.
     # since the result size filters out nodes, the result network is not complete anymore.
     # Therefore, it is necessary to find the shortest paths to the found nodes in case intermediate nodes have been removed. 
@@ -31,68 +72,42 @@ def scores_to_results(
     returned_edges = set()
     returned_nodes = set(seed_ids)  # return seed_ids in any case
 
+    # One breadth-first search per seed yields the paths from all candidates to this seed.
+    seed_distances, seed_predecessors = _shortest_path_trees(g, seed_ids) if best_candidates else ([], [])
+
     # return only the path to a drug with the shortest distance
     accepted_candidates = set()
-    if filterPaths:
-        for candidate in best_candidates:
-            distances = gtt.shortest_distance(g, candidate, seed_ids)
+    for candidate in best_candidates:
+        if filterPaths:
+            distances = np.array([dist[candidate] for dist in seed_distances], dtype=np.int32)
             closest_distance_mean = sum(distances) / len(distances)
 
-            for index, seed_id in enumerate(seed_ids):
-                if distances[index] > closest_distance_mean:
-                    continue
-                vertices, edges = gtt.shortest_path(g, candidate, seed_id)
-
-                drug_in_path = False
-                seed_in_path = False
-                for vertex in vertices:
-                    if g.vertex_properties["type"][int(vertex)] == "drug" and vertex != candidate:
-                        drug_in_path = True
-                        break
-                    if int(vertex) in seed_ids and int(vertex) != seed_id:
-                        seed_in_path = True
-                        break
-                if drug_in_path or seed_in_path:
-                    continue
-                accepted_candidates.add(g.vertex_properties[node_name_attribute][int(candidate)])
-                for vertex in vertices:
-                    if int(vertex) not in returned_nodes:
-                        # inserting intermediate node in order to make result comprehensive
-                        if vertex != candidate:
-                            intermediate_nodes.add(g.vertex_properties[node_name_attribute][int(vertex)])
-                        returned_nodes.add(int(vertex))
-                for edge in edges:
-                    if (((edge.source(), edge.target()) not in returned_edges) or (
-                            (edge.target(), edge.source()) not in returned_edges)) and int(edge.target()) in returned_nodes and int(edge.source()) in returned_nodes:
-                        returned_edges.add((edge.source(), edge.target()))
-    else:
-        for candidate in best_candidates:
-            for index, seed_id in enumerate(seed_ids):
-                vertices, edges = gtt.shortest_path(g, candidate, seed_id)
-
-                drug_in_path = False
-                seed_in_path = False
-                for vertex in vertices:
-                    if g.vertex_properties["type"][int(vertex)] == "drug" and vertex != candidate:
-                        drug_in_path = True
-                        break
-                    if int(vertex) in seed_ids and int(vertex) != seed_id:
-                        seed_in_path = True
-                        break
-                if drug_in_path or seed_in_path:
-                    continue
-                accepted_candidates.add(g.vertex_properties[node_name_attribute][int(candidate)])
-                for vertex in vertices:
-                    if int(vertex) not in returned_nodes:
-                        # inserting intermediate node in order to make result comprehensive
-                        if vertex != candidate:
-                            intermediate_nodes.add(g.vertex_properties[node_name_attribute][int(vertex)])
-                        returned_nodes.add(int(vertex))
-                for edge in edges:
-                    if (((edge.source(), edge.target()) not in returned_edges) or (
-                            (edge.target(), edge.source()) not in returned_edges)) and int(
-                        edge.target()) in returned_nodes and int(edge.source()) in returned_nodes:
-                        returned_edges.add((edge.source(), edge.target()))
+        for index, seed_id in enumerate(seed_ids):
+            if filterPaths and distances[index] > closest_distance_mean:
+                continue
+            vertices = _path(seed_distances[index], seed_predecessors[index], candidate)
+
+            drug_in_path = False
+            seed_in_path = False
+            for vertex in vertices:
+                if g.vertex_properties["type"][vertex] == "drug" and vertex != candidate:
+                    drug_in_path = True
+                    break
+                if is_seed_node[vertex] and vertex != seed_id:
+                    seed_in_path = True
+                    break
+            if drug_in_path or seed_in_path:
+                continue
+            accepted_candidates.add(g.vertex_properties[node_name_attribute][candidate])
+            for vertex in vertices:
+                if vertex not in returned_nodes:
+                    # inserting intermediate node in order to make result comprehensive
+                    if vertex != candidate:
+                        intermediate_nodes.add(g.vertex_properties[node_name_attribute][vertex])
+                    returned_nodes.add(vertex)
+            for source, target in zip(vertices[:-1], vertices[1:]):
+                edge = g.edge(source, target)
+                returned_edges.add((int(edge.source()), int(edge.target())))
     for node in accepted_candidates:
         if node in intermediate_nodes:
             intermediate_nodes.remove(node)
@@ -1,98 +1,208 @@
 import graph_tool as gt
 import graph_tool.topology as gtt
 import itertools as it
+import numpy as np
+import scipy.sparse as sp
+from collections import deque
+from scipy.sparse.csgraph import dijkstra, minimum_spanning_tree
+from tasks.util.seed_distances import adjacency_matrix
 
 
-def steiner_tree(g, seeds, seed_map, weights, non_zero_hub_penalty):
-    node_name_attribute = "internal_id" # nodes in the input network which is created from RepoTrialDB have primaryDomainId as name attribute
+class MetricClosure:
+    r"""Shortest paths between all pairs of seeds.
+
+    Runs one single-source search per seed instead of one search per seed pair. The path between
+    the i-th and the j-th seed with i < j is read from the shortest path tree of the i-th seed.
+
+    Parameters
+    ----------
+    g : graph_tool.Graph
+      The network, possibly filtered.
+
+    seed_ids : list of int
+      The vertex indices of the seeds.
+
+    weights : graph_tool.EdgePropertyMap
+      The edge weights used to find the shortest paths.
+    """
+
+    def __init__(self, g, seed_ids, weights, trees=None, paths=None):
+        self.seed_ids = list(seed_ids)
+        self.weights = weights
+        self.__trees = trees if trees is not None else [self.__search(g, seed_id) for seed_id in self.seed_ids]
+        # (i, j) -> path replacing the one in the tree of the i-th seed, see without_edge
+        self.__paths = paths if paths is not None else {}
+
+    def __search(self, g, seed_id):
+        _, pred = gtt.shortest_distance(g, seed_id, weights=self.weights, pred_map=True)
+        return pred.get_array().copy()
+
+    def path(self, i, j):
+        r"""Returns the vertices on the shortest path from the i-th to the j-th seed, [] if there is none."""
+        if (i, j) in self.__paths:
+            return self.__paths[(i, j)]
+        pred = self.__trees[i]
+        root = self.seed_ids[i]
+        node = self.seed_ids[j]
+        vertices = [node]
+        while node != root:
+            parent = int(pred[node])
+            if parent == node:
+                return []
+            vertices.append(parent)
+            node = parent
+        return vertices[::-1]
+
+    def without_edge(self, g, source, target):
+        r"""Returns the metric closure after removing the edge between source and target.
+
+        g has to be filtered such that the edge is removed. Only the paths between pairs of seeds which
+        use the edge are repaired, all other paths remain shortest paths. If a single path of the tree of
+        a seed is damaged, it is replaced by the result of a search between the two seeds, which stops
+        at the target seed. Trees with several damaged paths are searched again as a whole.
+        """
+        damaged = {}
+        for i, j in it.combinations(range(len(self.seed_ids)), 2):
+            path = self.path(i, j)
+            if any({u, v} == {source, target} for u, v in zip(path[:-1], path[1:])):
+                damaged.setdefault(i, []).append(j)
+
+        trees = list(self.__trees)
+        paths = dict(self.__paths)
+        for i, targets in damaged.items():
+            if len(targets) == 1:
+                vertices, _ = gtt.shortest_path(g, self.seed_ids[i], self.seed_ids[targets[0]], weights=self.weights)
+                paths[(i, targets[0])] = [int(vertex) for vertex in vertices]
+            else:
+                trees[i] = self.__search(g, self.seed_ids[i])
+                for j in range(i + 1, len(self.seed_ids)):
+                    paths.pop((i, j), None)
+        return MetricClosure(g, self.seed_ids, self.weights, trees, paths)
+
+
+def steiner_tree(g, seeds, seed_map, weights, non_zero_hub_penalty, closure=None):
+    r"""Computes a Steiner tree connecting the seeds with the heuristic of Kou, Markowsky and Berman.
+
+    The minimum spanning tree of the metric closure of the seeds, with the number of edges of the shortest
+    paths as distances, is expanded into its shortest paths. The minimum spanning tree of the union of these
+    paths, stripped of all leaves that are not seeds, is returned as a graph with the "internal_id" vertex
+    property and the "g_index" vertex property holding the index of every vertex in g. A metric closure computed for g, e.g. by MetricClosure.without_edge, can be passed as closure.
+    """
+    if closure is None:
+        closure = MetricClosure(g, [seed_map[seed] for seed in seeds], weights)
+
     mc = gt.Graph(directed=False)
+    mc.add_vertex(len(seeds))
     eprop_dist = mc.new_edge_property("int")
-    mc.ep['dist'] = eprop_dist
-    vprop_name = mc.new_vertex_property("string")
-    mc.vp[node_name_attribute] = vprop_name
-
-    eprop_path = mc.new_edge_property("object")
-    mc.ep['path'] = eprop_path
-
-    mc_vertex_map = dict()
-    mc_id_map = dict()
-    for i in range(len(seeds)):
-        vert = mc.add_vertex()
-        vprop_name[i] = seeds[i]
-        mc_vertex_map[seeds[i]] = vert
-        mc_id_map[vert] = i
-
-    for u, v in it.combinations(seeds, 2):
-        _, elist = gtt.shortest_path(g, g.vertex(seed_map[u]), g.vertex(seed_map[v]), weights=weights, negative_weights=False, pred_map=None, dag=False)
-        e = mc.add_edge(mc_vertex_map[u], mc_vertex_map[v])
-        eprop_dist[e] = len(elist)
-        mc.ep.path[e] = list(elist)
-
+    mc_paths = []
+    for i, j in it.combinations(range(len(seeds)), 2):
+        path = closure.path(i, j)
+        e = mc.add_edge(i, j)
+        eprop_dist[e] = max(len(path) - 1, 0)
+        mc_paths.append(path)
     mst = gtt.min_spanning_tree(mc, weights=eprop_dist, root=None, tree_map=None)
-    mc.set_edge_filter(mst)
 
+    return _tree_from_paths(g, seeds, seed_map, weights, non_zero_hub_penalty,
+                            [mc_paths[mc.edge_index[e]] for e in mc.edges() if mst[e]])
+
+
+def mehlhorn_steiner_tree(g, seeds, seed_map, weights, non_zero_hub_penalty, adjacency=None):
+    r"""Computes a Steiner tree connecting the seeds with Mehlhorn's heuristic [1_].
+
+    A single multi-source search from all seeds partitions the network into the Voronoi regions of the seeds.
+    Every edge between two regions yields a path between their seeds, the shortest of which form a graph on
+    the seeds whose minimum spanning tree is expanded into its paths. Like the heuristic of Kou, Markowsky and
+    Berman used by steiner_tree, this gives a 2-approximation, but takes O(E log V) time. The tree is built
+    from the paths as in steiner_tree and returned in the same format. The adjacency matrix of g with the
+    weights as entries, see seed_distances.adjacency_matrix, is built from g if not passed as adjacency.
+
+    References
+    ----------
+    .. [1] K. Mehlhorn, A faster approximation algorithm for the Steiner problem in graphs, Information
+       Processing Letters 27(3), 1988, pp. 125-128, https://doi.org/10.1016/0020-0190(88)90066-X.
+    """
+    seed_ids = [seed_map[seed] for seed in seeds]
+    if adjacency is None:
+        adjacency = adjacency_matrix(g, weights)
+    dist, pred, regions = dijkstra(adjacency, indices=seed_ids, min_only=True, return_predecessors=True)
+
+    # the shortest connection between every pair of adjacent Voronoi regions
+    edges = sp.triu(adjacency, format="coo")
+    crossing = (regions[edges.row] >= 0) & (regions[edges.col] >= 0) & (regions[edges.row] != regions[edges.col])
+    sources, targets = edges.row[crossing], edges.col[crossing]
+    lengths = dist[sources] + edges.data[crossing] + dist[targets]
+    seed_index = {seed_id: i for i, seed_id in enumerate(seed_ids)}
+    region_pairs = {}
+    for source, target, length in zip(sources.tolist(), targets.tolist(), lengths.tolist()):
+        pair = tuple(sorted((seed_index[regions[source]], seed_index[regions[target]])))
+        if pair not in region_pairs or length < region_pairs[pair][0]:
+            region_pairs[pair] = (length, source, target)
+
+    regions_graph = np.zeros((len(seeds), len(seeds)))
+    for (i, j), (length, _, _) in region_pairs.items():
+        regions_graph[i, j] = length
+    mst = minimum_spanning_tree(regions_graph).tocoo()
+
+    def path_to_seed(node):
+        vertices = [node]
+        while pred[node] >= 0:
+            node = int(pred[node])
+            vertices.append(node)
+        return vertices
+
+    paths = []
+    for i, j in sorted(zip(mst.row.tolist(), mst.col.tolist())):
+        _, source, target = region_pairs[(min(i, j), max(i, j))]
+        paths.append(path_to_seed(source)[::-1] + path_to_seed(target))
+    return _tree_from_paths(g, seeds, seed_map, weights, non_zero_hub_penalty, paths)
+
+
+def _tree_from_paths(g, seeds, seed_map, weights, non_zero_hub_penalty, paths):
+    node_name_attribute = "internal_id" # nodes in the input network which is created from RepoTrialDB have primaryDomainId as name attribute
+    # vertices of the union of the paths of all minimum spanning tree edges, seeds first
     g2 = gt.Graph(directed=False)
+    g2_vertex_map = {seed_map[seed]: i for i, seed in enumerate(seeds)}
+    g2_edges = []
+    g2_weights = []
+    for path in paths:
+        for source, target in zip(path[:-1], path[1:]):
+            for node in (source, target):
+                if node not in g2_vertex_map:
+                    g2_vertex_map[node] = len(g2_vertex_map)
+            g2_edges.append((g2_vertex_map[source], g2_vertex_map[target]))
+            g2_weights.append(weights[g.edge(source, target)] if non_zero_hub_penalty else 1.0)
+    g2.add_vertex(len(g2_vertex_map))
     vprop_name = g2.new_vertex_property("string")
     g2.vp[node_name_attribute] = vprop_name
-
-    g2_vertex_map = dict()
-    g2_id_map = dict()
-    addedNodes = set()
-    for i in range(len(seeds)):
-        vert = g2.add_vertex()
-        vprop_name[i] = seeds[i]
-        g2_vertex_map[seeds[i]] = vert
-        g2_id_map[vert] = i
-        addedNodes.add(seeds[i])
-
-    allmcedges = []
-
-    for mc_edges in mc.edges():
-        path = mc.ep.path[mc_edges]
-        allmcedges.extend(path)
-
-    j = len(seeds)
-    allmcedges_g2 = []
-    for e in allmcedges:
-        # sourceName = g.vertex_properties["name"][e.source()]
-        # targetName = g.vertex_properties["name"][e.target()]
-        sourceName = g.vertex_properties[node_name_attribute][e.source()]
-        targetName = g.vertex_properties[node_name_attribute][e.target()]
-        if sourceName not in addedNodes:
-            vert = g2.add_vertex()
-            vprop_name[j] = sourceName
-            g2_vertex_map[sourceName] = vert
-            g2_id_map[vert] = j
-            addedNodes.add(sourceName)
-            j += 1
-        if targetName not in addedNodes:
-            vert = g2.add_vertex()
-            vprop_name[j] = targetName
-            g2_vertex_map[targetName] = vert
-            g2_id_map[vert] = j
-            addedNodes.add(targetName)
-            j += 1
-        allmcedges_g2.append(g2.add_edge(g2_vertex_map[sourceName], g2_vertex_map[targetName]))
-    weights_g2 = g2.new_edge_property("double", val=1.0)
-    if non_zero_hub_penalty:
-        for e, e_g2 in zip(allmcedges, allmcedges_g2):
-            weights_g2[e_g2] = weights[e]
+    for node, i in g2_vertex_map.items():
+        vprop_name[i] = g.vertex_properties[node_name_attribute][node]
+    # the vertices of g2 are numbered in insertion order
+    vprop_index = g2.new_vertex_property("int", vals=list(g2_vertex_map))
+    g2.vp["g_index"] = vprop_index
+    weights_g2 = g2.new_edge_property("double")
+    g2.add_edge_list(g2_edges)
+    weights_g2.a[:len(g2_weights)] = g2_weights
     mst2 = gtt.min_spanning_tree(g2, root=None, tree_map=None, weights=weights_g2)
-    g2.set_edge_filter(mst2)
-
-    while True:
-        noneSteinerLeaves = []
-        for i in range(g2.num_vertices()):
-            if g2.vertex(i).out_degree() == 1 and g2.vertex_properties[node_name_attribute][i] not in seeds:
-                noneSteinerLeaves.append(i)
-        if len(noneSteinerLeaves) == 0:
-            break
-        noneSteinerLeaves = reversed(sorted(noneSteinerLeaves))
-        for node in noneSteinerLeaves:
-            g2.remove_edge(g2.edge(g2.vertex(node), g2.get_all_neighbors(node)[0]))
-            g2.remove_vertex(node)
-            
-    return g2
-
 
+    # strip leaves which are not seeds, the seeds are the first len(seeds) vertices of g2
+    degrees = [0] * g2.num_vertices()
+    neighbors = [[] for _ in range(g2.num_vertices())]
+    tree_edges = g2.get_edges([g2.edge_index])
+    for source, target in tree_edges[mst2.a[tree_edges[:, 2]].astype(bool), :2].tolist():
+        degrees[source] += 1
+        degrees[target] += 1
+        neighbors[source].append(target)
+        neighbors[target].append(source)
+    kept = [True] * g2.num_vertices()
+    leaves = deque(node for node in range(len(seeds), g2.num_vertices()) if degrees[node] == 1)
+    while leaves:
+        node = leaves.popleft()
+        kept[node] = False
+        for neighbor in neighbors[node]:
+            if kept[neighbor]:
+                degrees[neighbor] -= 1
+                if degrees[neighbor] == 1 and neighbor >= len(seeds):
+                    leaves.append(neighbor)
 
+    vfilt = g2.new_vertex_property("bool", vals=kept)
+    return gt.Graph(gt.GraphView(g2, vfilt=vfilt, efilt=mst2), prune=True)
@@ -0,0 +1,240 @@
+from collections import OrderedDict, deque
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from tasks.util import derived_cache
+
+# Number of transition matrices kept per worker process.
+TRANSITION_CACHE_SIZE = 8
+
+# cache key -> matrices returned by transition_matrix or walk_matrix, least recently used first
+__transitions = OrderedDict()
+
+
+def _remember(cache_key, matrices):
+    __transitions[cache_key] = matrices
+    while len(__transitions) > TRANSITION_CACHE_SIZE:
+        __transitions.popitem(last=False)
+
+
+def _load(g, name, cache_key):
+    # work horses are discarded after every job, the matrices are therefore also kept on disk
+    stored = derived_cache.load(g, name, cache_key, ["data", "indices", "indptr", "vector"])
+    if stored is None:
+        return None
+    num_vertices = g.num_vertices(ignore_filter=True)
+    matrix = csr_matrix((stored["data"], stored["indices"], stored["indptr"]), shape=(num_vertices, num_vertices))
+    return matrix, stored["vector"]
+
+
+def _store(g, name, cache_key, matrices):
+    matrix, vector = matrices
+    derived_cache.store(g, name, cache_key, {"data": matrix.data, "indices": matrix.indices, "indptr": matrix.indptr,
+                                             "vector": vector})
+
+
+def _edge_values(g, weights, edges):
+    if callable(edges):
+        return edges()
+    if edges is not None:
+        return edges
+    edges = g.get_edges([g.edge_index])
+    values = np.ones(len(edges)) if weights is None else weights.a[edges[:, 2]].astype(np.float64)
+    return edges[:, 0], edges[:, 1], values
+
+
+def transition_matrix(g, weights=None, cache_key=None, edges=None):
+    r"""Returns the column-stochastic transition matrix of a random walk on g.
+
+    Entry (v, u) is the probability w(u, v) / W(u) of moving from u to v, where W(u) is the total
+    weight of the edges of u. Every undirected edge can be traversed in both directions and
+    parallel edges add up, as in gtc.pagerank.
+
+    If cache_key is given, e.g. the "network_key" graph property of g together with the parameters
+    the weights were computed from, the matrix is kept in a process-wide LRU cache under this key
+    and stored on disk, see derived_cache. The sources, targets and weights returned by
+    edge_weights.weighted_edges can be passed as edges, which are then used instead of the edges
+    of g and weights, or a function returning them, which is only called if the matrix is not cached.
+
+    Returns
+    -------
+    transition : scipy.sparse.csr_matrix, shape (num_vertices, num_vertices)
+      The transition matrix.
+
+    dangling : numpy.ndarray of bool
+      True for vertices without incident edges, whose walks restart at the personalization vector.
+    """
+    if cache_key is not None and cache_key in __transitions:
+        __transitions.move_to_end(cache_key)
+        return __transitions[cache_key]
+    stored = _load(g, "transition", cache_key) if cache_key is not None else None
+    if stored is not None:
+        _remember(cache_key, stored)
+        return stored
+
+    num_vertices = g.num_vertices(ignore_filter=True)
+    edge_sources, edge_targets, values = _edge_values(g, weights, edges)
+    sources = np.concatenate([edge_sources, edge_targets])
+    targets = np.concatenate([edge_targets, edge_sources])
+    values = np.concatenate([values, values])
+    total_weights = np.bincount(sources, values, minlength=num_vertices)
+    dangling = total_weights == 0
+    transition = csr_matrix((values / total_weights[sources], (targets, sources)), shape=(num_vertices, num_vertices))
+
+    if cache_key is not None:
+        _remember(cache_key, (transition, dangling))
+        _store(g, "transition", cache_key, (transition, dangling))
+    return transition, dangling
+
+
+def walk_matrix(g, weights=None, cache_key=None, edges=None):
+    r"""Returns the row-stochastic counterpart of transition_matrix along with the total edge weight of every vertex.
+
+    Row u holds the probabilities of moving from u to each of its neighbors, so that the neighbors of
+    a vertex can be visited without touching the rest of the network. Cached like transition_matrix.
+    """
+    walk_key = None if cache_key is None else (cache_key, "walk")
+    if walk_key is not None and walk_key in __transitions:
+        __transitions.move_to_end(walk_key)
+        return __transitions[walk_key]
+    stored = _load(g, "walk", cache_key) if walk_key is not None else None
+    if stored is not None:
+        _remember(walk_key, stored)
+        return stored
+
+    edges = _edge_values(g, weights, edges)
+    transition, _ = transition_matrix(g, weights, cache_key, edges)
+    walk = transition.transpose().tocsr()
+    walk.sum_duplicates()
+    num_vertices = g.num_vertices(ignore_filter=True)
+    sources, targets, values = edges
+    total_weights = np.bincount(np.concatenate([sources, targets]), np.concatenate([values, values]),
+                                minlength=num_vertices)
+
+    if walk_key is not None:
+        _remember(walk_key, (walk, total_weights))
+        _store(g, "walk", cache_key, (walk, total_weights))
+    return walk, total_weights
+
+
+def approximate_trust_rank_scores(walk, total_weights, personalization, damping=0.85, threshold=1e-5):
+    r"""Approximates personalized PageRank scores by local forward push [1_].
+
+    Starting with the personalization vector as residual, the residual of a vertex u is pushed whenever
+    it exceeds threshold times the total edge weight of u: the fraction 1 - d is added to the score of u
+    and the rest is spread over its neighbors according to the random walk. Dangling vertices return their
+    share to the personalization vector, as in trust_rank_scores. Only vertices close to the personalized
+    ones are touched, so the work depends on the explored neighborhood and the threshold rather than the
+    size of the network.
+
+    Parameters
+    ----------
+    walk, total_weights :
+      The random walk and vertex weights returned by walk_matrix.
+
+    personalization : numpy.ndarray of float, shape (num_vertices,)
+      The personalization vector, summing up to one.
+
+    damping : float, optional (default: 0.85)
+      The damping factor d.
+
+    threshold : float, optional (default: 1e-5)
+      Residual per unit of edge weight below which a vertex is not pushed.
+
+    Returns
+    -------
+    scores : numpy.ndarray of float
+      The approximate scores, which never exceed the exact scores.
+
+    error_bound : float
+      The sum of the remaining residuals, an upper bound of the L1 distance to the exact scores.
+
+    num_pushes : int
+      The number of push operations performed.
+
+    References
+    ----------
+    .. [1] R. Andersen, F. Chung, K. Lang, Local Graph Partitioning using PageRank Vectors,
+       FOCS, 2006, pp. 475-486, https://doi.org/10.1109/FOCS.2006.44.
+    """
+    scores = np.zeros(len(personalization))
+    residuals = np.array(personalization, dtype=np.float64)
+    personalized = np.flatnonzero(residuals)
+    # dangling vertices have no edge weight, they are pushed once their residual exceeds threshold
+    thresholds = threshold * np.where(total_weights > 0, total_weights, 1.0)
+    queued = residuals > thresholds
+    queue = deque(np.flatnonzero(queued).tolist())
+    num_pushes = 0
+    while queue:
+        node = queue.popleft()
+        queued[node] = False
+        residual = residuals[node]
+        residuals[node] = 0.0
+        scores[node] += (1.0 - damping) * residual
+        num_pushes += 1
+        if total_weights[node] > 0:
+            neighbors = walk.indices[walk.indptr[node]:walk.indptr[node + 1]]
+            residuals[neighbors] += damping * residual * walk.data[walk.indptr[node]:walk.indptr[node + 1]]
+        else:
+            neighbors = personalized
+            residuals[neighbors] += damping * residual * personalization[neighbors]
+        exceeding = neighbors[(residuals[neighbors] > thresholds[neighbors]) & ~queued[neighbors]]
+        queued[exceeding] = True
+        queue.extend(exceeding.tolist())
+    return scores, residuals.sum(), num_pushes
+
+
+def trust_rank_scores(transition, dangling, personalization, damping=0.85, tolerance=1e-6, max_iterations=None,
+                      initial=None):
+    r"""Computes personalized PageRank scores for one or many personalization vectors by power iteration.
+
+    Iterates :math:`P \leftarrow (1 - d) p + d (M P + p \sum_{u \text{ dangling}} P_u)` for all columns p of
+    the personalization matrix at once, so that every iteration is a single sparse matrix times dense
+    matrix product.
+
+    Parameters
+    ----------
+    transition, dangling :
+      The transition matrix and dangling vertices returned by transition_matrix.
+
+    personalization : numpy.ndarray of float, shape (num_vertices,) or (num_vertices, k)
+      One personalization vector per column, each summing up to one.
+
+    damping : float, optional (default: 0.85)
+      The damping factor d.
+
+    tolerance : float, optional (default: 1e-6)
+      The iteration stops once the L1 norm of the change of every column is below tolerance.
+
+    max_iterations : int, optional (default: None)
+      Maximal number of iterations, unlimited if None.
+
+    initial : numpy.ndarray of float, optional (default: None)
+      Start vectors with the shape of personalization, e.g. the scores for a similar seed set.
+      The personalization vectors are used if None.
+
+    Returns
+    -------
+    scores : numpy.ndarray of float
+      The scores with the shape of personalization.
+
+    num_iterations : int
+      The number of iterations performed.
+    """
+    personalization = np.asarray(personalization, dtype=np.float64)
+    scores = personalization.copy() if initial is None else np.array(initial, dtype=np.float64)
+    num_iterations = 0
+    while max_iterations is None or num_iterations < max_iterations:
+        dangling_mass = scores[dangling].sum(axis=0)
+        updated = (1.0 - damping) * personalization + damping * (transition @ scores + personalization * dangling_mass)
+        num_iterations += 1
+        converged = np.all(np.abs(updated - scores).sum(axis=0) < tolerance)
+        scores = updated
+        if converged:
+            break
+    return scores, num_iterations
+
+
+def clear():
+    r"""Drops all transition matrices cached by this process, the ones stored on disk are kept."""
+    __transitions.clear()